@@ -0,0 +1,97 @@
+import time
+import sqlite3
+import pandas as pd
+
+from record_cache import CACHE_PATH
+from matching import match_records
+
+
+#####################################
+# Per-person, per-year record counts
+#####################################
+# Every time a person's records are fetched or refreshed their row block in
+# person_year_counts is replaced, so department and college roll-ups are a
+# group-by over this table and never touch the APIs.
+
+count_columns = ['wos', 'alex', 'overlap', 'unique_records']
+
+
+def _connect():
+    con = sqlite3.connect(CACHE_PATH, timeout=30)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS person_year_counts (
+                       emp_id INTEGER NOT NULL,
+                       year INTEGER NOT NULL,
+                       wos INTEGER NOT NULL,
+                       alex INTEGER NOT NULL,
+                       overlap INTEGER NOT NULL,
+                       unique_records INTEGER NOT NULL,
+                       PRIMARY KEY (emp_id, year))''')
+    con.execute('''CREATE TABLE IF NOT EXISTS person_counts_updated (
+                       emp_id INTEGER PRIMARY KEY,
+                       min_year INTEGER NOT NULL,
+                       updated_at REAL NOT NULL)''')
+    return con
+
+
+def person_year_counts(df_wos, df_alex):
+    ### WOS, OpenAlex, matched (overlap) and single-source (unique) records per
+    ### publication year; a matched pair is counted in its WOS year
+    if df_wos is None:
+        df_wos = pd.DataFrame({'title': [], 'publishYear': [], 'doi': []})
+    if df_alex is None:
+        df_alex = pd.DataFrame({'work_title': [], 'work_publication_year': [], 'work_doi': []})
+    pairs, wos_only, alex_only = match_records(df_wos, df_alex)
+    counts = pd.DataFrame({
+        'wos': df_wos['publishYear'].value_counts(),
+        'alex': df_alex['work_publication_year'].value_counts(),
+        'overlap': df_wos['publishYear'].iloc[pairs['row_wos'].to_numpy()].value_counts(),
+        'unique_records': wos_only['publishYear'].value_counts().add(
+            alex_only['work_publication_year'].value_counts(), fill_value=0),
+    })
+    counts = counts.fillna(0).astype('int64')
+    counts.index = counts.index.astype('int64')
+    return counts.rename_axis('year').reset_index()
+
+
+def update_person_counts(emp_id, df_wos, df_alex, min_year):
+    counts = person_year_counts(df_wos, df_alex)
+    rows = [(emp_id, int(r.year), int(r.wos), int(r.alex), int(r.overlap), int(r.unique_records))
+            for r in counts.itertuples(index=False)]
+    con = _connect()
+    try:
+        with con:
+            con.execute('DELETE FROM person_year_counts WHERE emp_id=?', (emp_id,))
+            con.executemany('INSERT INTO person_year_counts VALUES (?, ?, ?, ?, ?, ?)', rows)
+            ### min_year: the floor of the stored records the counts were built
+            ### from. It replaces the previous floor: an evicted entry harvested
+            ### again from a later year holds a shorter history than before
+            con.execute('INSERT OR REPLACE INTO person_counts_updated VALUES (?, ?, ?)',
+                        (emp_id, min_year, time.time()))
+    finally:
+        con.close()
+
+
+def load_counts(min_year):
+    con = _connect()
+    try:
+        counts = pd.read_sql_query('SELECT * FROM person_year_counts WHERE year>=?', con, params=(min_year,))
+        covered = pd.read_sql_query('SELECT emp_id, min_year FROM person_counts_updated', con)
+    finally:
+        con.close()
+    return counts, covered
+
+
+def rollup(roster_in, level, value, min_year, breakdown):
+    ### roster_in: employees with emp_id, department, college and preferred_name.
+    ### Returns (by_year, by_group, n_covered, n_people) for the people whose
+    ### level ('department' or 'college') equals value; by_group is split by
+    ### the breakdown column.
+    people = roster_in.loc[roster_in[level]==value, ['emp_id', breakdown]]
+    counts, covered = load_counts(min_year)
+    counts = counts.merge(people, on='emp_id', how='inner')
+    by_year = counts.groupby('year')[count_columns].sum().sort_index(ascending=False).reset_index()
+    by_group = counts.groupby(breakdown, observed=True)[count_columns].sum().sort_values('wos', ascending=False).reset_index()
+    ### people whose stored history reaches back to min_year
+    n_covered = int(covered.loc[covered['min_year']<=min_year, 'emp_id'].isin(people['emp_id']).sum())
+    return by_year, by_group, n_covered, len(people)
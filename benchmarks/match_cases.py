@@ -0,0 +1,70 @@
+import sys
+
+from records import WorkBuffer
+from matching import match_records
+
+
+#####################################
+# Matching regression cases
+#####################################
+# Hand-picked WOS / OpenAlex title pairs, each pair in one venue and year, so
+# only the title decides. The synthetic benchmark titles carry a unique number
+# and cannot catch a matcher that pairs different papers. Run on its own or
+# as part of the match benchmark:
+#
+#     python -m benchmarks.match_cases       # exits 1 when a case fails
+
+### different papers: one title is found inside the other
+distinct_pairs = [
+    ('Machine learning for protein folding',
+     'Interpretable machine learning for protein folding kinetics'),
+    ('Denitrification in coastal sediments',
+     'Seasonal controls on denitrification in coastal sediments of Mission Bay'),
+    ('Teacher identity and social justice',
+     'Preservice teacher identity and social justice pedagogy in urban classrooms'),
+    ('Denitrification in coastal sediments',
+     'Denitrification in coastal sediments of Mission Bay and the Tijuana River estuary'),
+    ('Adaptive governance of marine protected areas, part 1',
+     'Adaptive governance of marine protected areas, part 2'),
+]
+
+### the same paper spelled differently by the two sources
+same_pairs = [
+    ('Effects of salt &amp; pepper on <i>mice</i>: a randomized trial',
+     'Effects of salt & pepper on mice - a randomized trial'),
+    ('Coastal ecology of the Pacific shelf: dynamics and sediments in a changing climate',
+     'Coastal ecology of the Pacific shelf'),
+    ('Non-linear dynamics of urban policy networks',
+     'Nonlinear dynamics of urban policy networks'),
+    ('Social identity and the governance of shared coastal fisheries in Southern California',
+     'Social identity and the governance of shared coastal fisheries in Southern'),
+    ('Ethnic identity among first generation college students',
+     'ETHNIC IDENTITY AMONG FIRST-GENERATION COLLEGE STUDENTS'),
+]
+
+
+def pair_matches(wos_title, alex_title, venue='Journal of Applied Studies', year=2020):
+    wos = WorkBuffer('wos')
+    alex = WorkBuffer('alex')
+    wos.append('WOS:1', wos_title, venue, year, None, None, None)
+    alex.append('https://openalex.org/W1', alex_title, year, venue, None)
+    pairs, _, _ = match_records(wos.to_frame(), alex.to_frame())
+    return len(pairs) != 0
+
+
+def check_cases():
+    ### (wos title, alex title, expected) of every failing case
+    failures = []
+    for expected, cases in ((False, distinct_pairs), (True, same_pairs)):
+        for wos_title, alex_title in cases:
+            if pair_matches(wos_title, alex_title) != expected:
+                failures.append((wos_title, alex_title, expected))
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check_cases()
+    for wos_title, alex_title, expected in failures:
+        print(f'{"not matched" if expected else "matched"}: {wos_title!r} / {alex_title!r}')
+    print(f'{len(distinct_pairs)+len(same_pairs)-len(failures)}/{len(distinct_pairs)+len(same_pairs)} cases pass')
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import copy
+import glob
+import time
+import zlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from data_store import read_store, ID_LOOKUP_PATH
+
+
+#####################################
+# Local stand-ins for WOS Starter and OpenAlex
+#####################################
+# One HTTP server answers both APIs:
+#
+#     {url}/wos-starter/v1/documents   WOS Starter documents_get
+#     {url}/openalex/works             OpenAlex works (page and cursor paging)
+#
+# Every author gets `works` synthetic works; `overlap` of them are listed by
+# both sources (same DOI and title), the rest are split between WOS only and
+# OpenAlex only. The WOS and OpenAlex ids of one roster employee (id_lookup)
+# share their works, so the sources overlap for roster people as well; other
+# ids are authors of their own. With a recorded directory (wos/*.json and openalex/*.json,
+# saved API responses) the recorded records are used as templates and re-keyed,
+# so payload shape and size follow the real APIs. `latency` seconds are added
+# to every response.
+#
+#     python -m benchmarks.mock_apis --port 8600 --works 1000 --latency 0.2
+#
+# then start the dashboard with WOS_API_HOST=http://127.0.0.1:8600/wos-starter/v1
+# and OPENALEX_API_URL=http://127.0.0.1:8600/openalex.
+
+WOS_PATH = '/wos-starter/v1'
+OPENALEX_PATH = '/openalex'
+usd_alex_id = 'https://openalex.org/I160856358'
+
+title_words = ['adaptive', 'coastal', 'urban', 'neural', 'ethical', 'microbial', 'bayesian', 'marine', 'social',
+               'learning', 'networks', 'ecology', 'policy', 'dynamics', 'education', 'chemistry', 'governance',
+               'sediments', 'language', 'signals', 'identity', 'markets', 'catalysis', 'memory']
+journals = ['Journal of Applied Studies', 'Marine Ecology Letters', 'Review of Education Research',
+            'Physical Chemistry Reports', 'Law and Society Quarterly', 'Computational Methods']
+
+
+class MockConfig:
+    def __init__(self, works=100, overlap=0.5, latency=0.0, recorded=None):
+        self.works = works
+        self.overlap = overlap
+        self.latency = latency
+        self.wos_templates = []
+        self.alex_templates = []
+        if recorded is not None:
+            self.load_recorded(recorded)
+        self.n_requests = 0
+        self.lock = threading.Lock()
+        self._works = {}
+        self.work_keys = load_work_keys()
+
+    def load_recorded(self, path):
+        for file in sorted(glob.glob(os.path.join(path, 'wos', '*.json'))):
+            with open(file) as f:
+                self.wos_templates.extend(json.load(f)['hits'])
+        for file in sorted(glob.glob(os.path.join(path, 'openalex', '*.json'))):
+            with open(file) as f:
+                self.alex_templates.extend(json.load(f)['results'])
+
+    def author_works(self, author_id):
+        ### (wos_hits, alex_works) for one author id, built once per (id, size)
+        key = (author_id, self.works, self.overlap)
+        with self.lock:
+            if key not in self._works:
+                self._works[key] = synthetic_works(self.work_keys.get(author_id, author_id), self.works, self.overlap,
+                                                   self.wos_templates, self.alex_templates, author_id)
+            return self._works[key]
+
+
+def load_work_keys(path=ID_LOOKUP_PATH):
+    ### author id -> the employee whose works it lists
+    if not os.path.exists(path):
+        return {}
+    work_keys = {}
+    for row in read_store(path, ['emp_id', 'wos_id', 'alex_id']).itertuples(index=False):
+        for author_id in (row.wos_id, row.alex_id):
+            if isinstance(author_id, str):
+                work_keys[author_id] = f'EMP{int(row.emp_id)}'
+    return work_keys
+
+
+def synthetic_works(work_key, n_works, overlap, wos_templates=(), alex_templates=(), author_id=None):
+    ### the works follow from work_key; author_id (default work_key) is the
+    ### id the records are listed under
+    if author_id is None:
+        author_id = work_key
+    seed = zlib.crc32(work_key.encode())
+    wos_hits = []
+    alex_works = []
+    for i in range(n_works):
+        h = zlib.crc32(f'{work_key}-{i}'.encode())
+        words = [title_words[(h >> shift) % len(title_words)] for shift in (0, 5, 10, 15)]
+        title = f'{words[0].capitalize()} {words[1]} and {words[2]} {words[3]}: study {seed % 997}-{i}'
+        year = 1985 + (h >> 20) % 40
+        doi = f'10.5555/{work_key.lower()}.{i}' if (h % 5) != 0 else None
+        journal = journals[h % len(journals)]
+        share = (h % 1000)/1000
+        in_wos = share < overlap + (1-overlap)/2
+        in_alex = (share < overlap) or not in_wos
+        if in_wos:
+            wos_hits.append(wos_hit(f'WOS:{seed:010d}{i:06d}', title, year, doi, journal, author_id,
+                                    wos_templates[i % len(wos_templates)] if wos_templates else None))
+        if in_alex:
+            ### OpenAlex spells titles and DOIs differently from WOS
+            alex_works.append(alex_work(f'https://openalex.org/W{seed:010d}{i:06d}', title.upper(), year,
+                                        f'https://doi.org/{doi}' if doi else None, journal, author_id,
+                                        alex_templates[i % len(alex_templates)] if alex_templates else None))
+    return wos_hits, alex_works
+
+
+def wos_hit(uid, title, year, doi, journal, author_id, template=None):
+    if template is not None:
+        hit = copy.deepcopy(template)
+    else:
+        hit = {'types': ['Article'], 'sourceTypes': ['Article'],
+               'source': {'publishMonth': 'JAN', 'volume': '12', 'issue': '3',
+                          'pages': {'range': '101-118', 'begin': '101', 'end': '118', 'count': 18}},
+               'names': {'authors': [{'displayName': 'Doe, Jane', 'wosStandard': 'Doe, J', 'researcherId': author_id},
+                                     {'displayName': 'Roe, Rick', 'wosStandard': 'Roe, R'}]},
+               'links': {'record': 'https://www.webofscience.com/wos/woscc/full-record/' + uid},
+               'citations': [{'db': 'WOS', 'count': 7}],
+               'identifiers': {'issn': '1234-5678', 'eissn': '8765-4321'},
+               'keywords': {'authorKeywords': ['benchmark']}}
+    hit['uid'] = uid
+    hit['title'] = title
+    hit.setdefault('source', {})
+    hit['source']['sourceTitle'] = journal
+    hit['source']['publishYear'] = year
+    hit.setdefault('identifiers', {})
+    hit['identifiers'].pop('doi', None)
+    if doi is not None:
+        hit['identifiers']['doi'] = doi
+    return hit
+
+
+def alex_work(work_id, title, year, doi, journal, author_id, template=None):
+    if template is not None:
+        work = copy.deepcopy(template)
+    else:
+        work = {'publication_date': f'{year}-01-15', 'open_access': {'is_oa': False, 'oa_status': 'closed'},
+                'cited_by_count': 7, 'is_retracted': False, 'is_paratext': False,
+                'updated_date': '2020-01-01T00:00:00', 'created_date': '2016-06-24',
+                'authorships': [{'author_position': 'middle',
+                                 'author': {'id': 'https://openalex.org/A0000000001', 'display_name': 'Rick Roe'},
+                                 'institutions': [{'id': 'https://openalex.org/I1', 'display_name': 'Elsewhere'}]}]}
+    work['id'] = work_id
+    work['ids'] = {'openalex': work_id, 'doi': doi}
+    work['title'] = title
+    work['display_name'] = title
+    work['publication_year'] = year
+    work['primary_location'] = {'source': {'id': 'https://openalex.org/S1', 'display_name': journal, 'issn_l': '1234-5678'}}
+    work['authorships'] = [{'author_position': 'first',
+                            'author': {'id': 'https://openalex.org/'+author_id, 'display_name': 'Jane Doe'},
+                            'institutions': [{'id': usd_alex_id, 'display_name': 'University of San Diego'}]}] \
+        + [authorship for authorship in work.get('authorships', [])
+           if authorship.get('author', {}).get('id') != 'https://openalex.org/'+author_id][:20]
+    return work
+
+
+def wos_documents(config, params):
+    q = params.get('q', '')
+    author = re.search(r'AI=(\S+)', q)
+    years = re.search(r'PY=\((\d+)-(\d+)\)', q)
+    limit = min(int(params.get('limit', 10)), 50)
+    page = int(params.get('page', 1))
+    hits = config.author_works(author.group(1) if author else 'unknown')[0]
+    if years:
+        hits = [hit for hit in hits if int(years.group(1)) <= hit['source']['publishYear'] <= int(years.group(2))]
+    if params.get('modifiedTimeSpan'):
+        ### synthetic records are never modified
+        hits = []
+    return 200, {'metadata': {'total': len(hits), 'page': page, 'limit': limit},
+                 'hits': hits[(page-1)*limit: page*limit]}
+
+
+def alex_works(config, params):
+    filters = dict(part.split(':', 1) for part in params.get('filter', '').split(',') if ':' in part)
+    per_page = min(int(params.get('per-page', 25)), 200)
+    works = config.author_works(filters.get('author.id', 'unknown'))[1]
+    if 'publication_year' in filters:
+        works = [work for work in works if work['publication_year'] > int(filters['publication_year'].lstrip('>'))]
+    if 'from_updated_date' in filters:
+        works = [work for work in works if work['updated_date'][:10] >= filters['from_updated_date']]
+    meta = {'count': len(works), 'per_page': per_page}
+    if 'cursor' in params:
+        start = 0 if params['cursor'] == '*' else int(params['cursor'])
+        meta['next_cursor'] = str(start+per_page) if start < len(works) else None
+        return 200, {'meta': meta, 'results': works[start: start+per_page]}
+    page = int(params.get('page', 1))
+    if page*per_page > 10000:
+        return 400, {'error': 'Invalid query parameters error.',
+                     'message': 'Maximum results size of 10,000 records is exceeded. Cursor pagination is required for records beyond 10,000.'}
+    meta['page'] = page
+    return 200, {'meta': meta, 'results': works[(page-1)*per_page: page*per_page]}
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            with config.lock:
+                config.n_requests += 1
+            if config.latency:
+                time.sleep(config.latency)
+            if url.path == WOS_PATH + '/documents':
+                status, body = wos_documents(config, params)
+            elif url.path == OPENALEX_PATH + '/works':
+                status, body = alex_works(config, params)
+            else:
+                status, body = 404, {'error': f'unknown path {url.path}'}
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_mock_server(config, port=0):
+    ### serves in a daemon thread; returns (server, base url)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    server.request_queue_size = 256
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve stand-in WOS Starter and OpenAlex APIs.')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--works', type=int, default=100, help='works per author')
+    parser.add_argument('--overlap', type=float, default=0.5, help='share of works listed by both sources')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--recorded', help='directory of recorded responses (wos/*.json, openalex/*.json)')
+    args = parser.parse_args()
+    server, url = start_mock_server(MockConfig(args.works, args.overlap, args.latency, args.recorded), args.port)
+    print(f'WOS_API_HOST={url}{WOS_PATH}')
+    print(f'OPENALEX_API_URL={url}{OPENALEX_PATH}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
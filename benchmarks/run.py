@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_apis import MockConfig, start_mock_server, WOS_PATH, OPENALEX_PATH
+
+
+#####################################
+# Offline benchmarks
+#####################################
+# Runs the fetch, matching and dashboard callback paths against the local
+# stand-in APIs (benchmarks/mock_apis.py), so no API quota is used. The
+# publication store, metrics and job cache go to a temporary directory.
+#
+#     python -m benchmarks.run --quick
+#     python -m benchmarks.run --save-baseline       # on the reference machine
+#     python -m benchmarks.run                       # exits 1 on a regression
+#
+# Results are seconds (lower is better). A result is flagged when it is more
+# than --tolerance above the stored baseline.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+full_scales = {'works': [10, 100, 1000, 5000], 'users': [1, 10, 100, 500]}
+quick_scales = {'works': [10, 1000], 'users': [1, 10]}
+
+
+def configure_environment(url, work_dir):
+    ### must run before the dashboard modules are imported, they read these once
+    os.environ['WOS_API_HOST'] = url + WOS_PATH
+    os.environ['OPENALEX_API_URL'] = url + OPENALEX_PATH
+    os.environ['RECORD_CACHE_PATH'] = os.path.join(work_dir, 'record_cache.sqlite')
+    os.environ['RECORD_STORE_DIR'] = os.path.join(work_dir, 'pub_store')
+    os.environ['METRICS_PATH'] = os.path.join(work_dir, 'metrics.sqlite')
+    os.environ['JOB_CACHE_DIR'] = os.path.join(work_dir, 'job_cache')
+    ### the stand-in servers have no quota; export these to benchmark with the real limits
+    os.environ.setdefault('OPENALEX_RATE', '100000')
+    os.environ.setdefault('WOS_RATE', '100000')
+
+
+def summarize(times):
+    times = sorted(times)
+    return {'median': statistics.median(times),
+            'p95': times[min(len(times)-1, int(0.95*len(times)))],
+            'n': len(times)}
+
+
+def time_calls(fn, args_in):
+    times = []
+    for args in args_in:
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter()-t0)
+    return summarize(times)
+
+
+def bench_fetch(config, scales, repeat):
+    from fetch_engine import create_record_tbl, get_open_alex_data_ai, api_inst, first_year
+    results = {}
+    for n_works in scales['works']:
+        config.works = n_works
+        ### a new author id per run, so every run is a full (uncached) harvest
+        authors = [f'BENCH{n_works}R{i}{time.time_ns()}' for i in range(repeat)]
+        for author in authors:
+            config.author_works(author)
+        results[f'fetch.wos.create_record_tbl.works={n_works}'] = \
+            time_calls(lambda author: create_record_tbl([author], api_inst, first_year, max_age=0), [(a,) for a in authors])
+        results[f'fetch.alex.get_open_alex_data_ai.works={n_works}'] = \
+            time_calls(lambda author: get_open_alex_data_ai(author, None, first_year), [(a,) for a in authors])
+    return results
+
+
+def bench_match(config, scales, repeat):
+    from index import find_common_records
+    from fetch_engine import parse_wos_pages, parse_open_alex_works
+    from benchmarks.match_cases import check_cases
+    ### a faster matcher that pairs the wrong records is not a result
+    failures = check_cases()
+    if failures:
+        raise RuntimeError(f'{len(failures)} matching case(s) fail, see python -m benchmarks.match_cases')
+    results = {}
+    for n_works in scales['works']:
+        config.works = n_works
+        wos_hits, alex_works = config.author_works(f'MATCH{n_works}')
+        df_wos = parse_wos_pages([{'hits': wos_hits}])
+        df_alex = parse_open_alex_works([alex_works], f'MATCH{n_works}').to_frame()
+        results[f'match.find_common_records.works={n_works}'] = \
+            time_calls(find_common_records, [(df_wos, df_alex)]*repeat)
+    return results
+
+
+def callback_body(component, selection, year, table=True):
+    ### request body of a /_dash-update-component call, as the browser sends it
+    inputs = [{'id': 'emp_records', 'property': 'data', 'value': selection},
+              {'id': 'emp_partial', 'property': 'data', 'value': None},
+              {'id': 'min_year_select', 'property': 'value', 'value': year}]
+    state = [{'id': 'employee_input_value', 'property': 'value', 'value': selection['employee']}]
+    if not table:
+        return {'output': f'{component}.children', 'outputs': {'id': component, 'property': 'children'},
+                'inputs': inputs, 'state': state, 'changedPropIds': ['emp_records.data']}
+    props = ['data', 'columns', 'page_count', 'page_current']
+    inputs = inputs + [{'id': component, 'property': 'page_current', 'value': 0},
+                       {'id': component, 'property': 'page_size', 'value': 25},
+                       {'id': component, 'property': 'sort_by', 'value': [{'column_id': 'publishYear', 'direction': 'desc'}]
+                        if component != 'alex_table' else []},
+                       {'id': component, 'property': 'filter_query', 'value': ''}]
+    return {'output': '..' + '...'.join(f'{component}.{p}' for p in props) + '..',
+            'outputs': [{'id': component, 'property': p} for p in props],
+            'inputs': inputs, 'state': state, 'changedPropIds': ['emp_records.data']}
+
+
+def bench_callbacks(config, scales, repeat, n_employees=20):
+    ### end-to-end latency of the tab callbacks through Dash's HTTP dispatch,
+    ### with users sending requests at the same time
+    import index
+    from roster import emp_by_id
+    from fetch_engine import fetch_emp_records, first_year
+    year = first_year
+    people = [record for record in emp_by_id.values()
+              if (len(record['wos_ids'])!=0 and None not in record['wos_ids']) and len(record['alex_ids'])!=0][:n_employees]
+    components = [('emp_info1', False), ('wos_table', True), ('alex_table', True), ('common_table', True)]
+    results = {}
+    for n_works in scales['works']:
+        config.works = n_works
+        selections = []
+        for record in people:
+            fetch_emp_records(record, year, max_age=0)
+            selections.append({'employee': record['preferred_name'], 'min_year': year, 'fetched_at': time.time()})
+        for n_users in scales['users']:
+            index.selection_records.cache_clear()
+            rng = random.Random(n_users)
+
+            def user_session(_):
+                client = index.server.test_client()
+                times = []
+                for _ in range(repeat):
+                    selection = rng.choice(selections)
+                    for component, table in components:
+                        t0 = time.perf_counter()
+                        resp = client.post('/_dash-update-component', json=callback_body(component, selection, year, table))
+                        times.append(time.perf_counter()-t0)
+                        if resp.status_code != 200:
+                            raise RuntimeError(f'{component}: HTTP {resp.status_code}')
+                return times
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=n_users) as pool:
+                times = [t for user_times in pool.map(user_session, range(n_users)) for t in user_times]
+            wall = time.perf_counter()-t0
+            result = summarize(times)
+            result['requests_per_second'] = len(times)/wall
+            results[f'callbacks.works={n_works}.users={n_users}'] = result
+    return results
+
+
+def compare(results, baselines, tolerance):
+    ### names of the results whose p95 is more than tolerance above the baseline
+    regressions = []
+    for name, result in results.items():
+        if name in baselines and result['p95'] > baselines[name]['p95']*(1+tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard against local stand-in APIs.')
+    parser.add_argument('--suite', default='fetch,match,callbacks', help='comma separated: fetch, match, callbacks')
+    parser.add_argument('--quick', action='store_true', help='small scales only')
+    parser.add_argument('--works', help='comma separated works per author, e.g. 10,100,5000')
+    parser.add_argument('--users', help='comma separated concurrent users, e.g. 1,100,500')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scale (requests per user for callbacks)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every stand-in API response')
+    parser.add_argument('--overlap', type=float, default=0.5, help='share of works listed by both sources')
+    parser.add_argument('--recorded', help='directory of recorded API responses used as record templates')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a result is flagged')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    scales = dict(quick_scales if args.quick else full_scales)
+    if args.works:
+        scales['works'] = [int(n) for n in args.works.split(',')]
+    if args.users:
+        scales['users'] = [int(n) for n in args.users.split(',')]
+
+    config = MockConfig(overlap=args.overlap, latency=args.latency, recorded=args.recorded)
+    server, url = start_mock_server(config)
+    configure_environment(url, tempfile.mkdtemp(prefix='dashboard-bench-'))
+
+    suites = {'fetch': bench_fetch, 'match': bench_match, 'callbacks': bench_callbacks}
+    results = {}
+    for suite in args.suite.split(','):
+        t0 = time.time()
+        results.update(suites[suite](config, scales, args.repeat))
+        print(f'{suite}: {time.time()-t0:.1f}s, {config.n_requests} stand-in API requests so far')
+    server.shutdown()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines, args.tolerance)
+    for name, result in results.items():
+        line = f'{name:<55} median {result["median"]*1000:9.1f} ms   p95 {result["p95"]*1000:9.1f} ms'
+        if 'requests_per_second' in result:
+            line += f'   {result["requests_per_second"]:8.1f} req/s'
+        if name in baselines:
+            line += f'   baseline p95 {baselines[name]["p95"]*1000:9.1f} ms'
+        if name in regressions:
+            line += '   REGRESSION'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'baseline written to {args.baseline}')
+    elif regressions:
+        print(f'{len(regressions)} regression(s) against {args.baseline}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+import threading
+import pandas as pd
+import pyarrow.feather as feather
+
+
+#####################################
+# Columnar data files
+#####################################
+# The roster and id lookup are stored as uncompressed Arrow IPC files: a read
+# maps the file and decodes only the requested columns, with no unpickling.
+# The result is an ordinary pandas DataFrame, so every worker process holds
+# its own copy of what it reads (string columns as Python objects, categories
+# as codes). Sharing pages between workers is not attempted: the roster is
+# turned into per-employee dicts at import, and store reads are filtered,
+# matched and serialized per request, each of which copies anyway; keeping
+# Arrow-backed columns would change every downstream dtype for files of a few
+# tens of kilobytes. Rebuild the files after the HR export (CAS_mod.pkl /
+# id_lookup.pkl) changes:
+#
+#     python data_store.py
+
+ROSTER_PATH = "Data/roster.arrow"
+ID_LOOKUP_PATH = "Data/id_lookup.arrow"
+
+search_words = ['Professor', 'Assistant Professor', 'Associate Professor', 'Lecturer']
+
+
+def read_store(path, columns=None):
+    ### the mapping only lives for the read; to_pandas copies into the process
+    return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+def write_store(df, path):
+    ### write then rename, so readers never map a partial file
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    feather.write_feather(df, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def write_roster_store(cas_path="Data/CAS_mod.pkl", id_lookup_path="Data/id_lookup.pkl"):
+    CAS = pd.read_pickle(cas_path)
+    CAS.columns = CAS.columns.str.lower()
+    pattern = '|'.join(search_words)
+    ### the faculty filter behind emp is computed here, once
+    CAS['is_faculty'] = CAS['position'].str.contains(pattern, case=False, na=False)
+    for col in ['first_name','last_name','preferred_name','position','department','college']:
+        CAS[col] = CAS[col].astype('category')
+    write_store(CAS, ROSTER_PATH)
+
+    id_lookup = pd.read_pickle(id_lookup_path)
+    write_store(id_lookup, ID_LOOKUP_PATH)
+
+
+if __name__ == '__main__':
+    write_roster_store()
+    print(f'wrote {ROSTER_PATH} and {ID_LOOKUP_PATH}')
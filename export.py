@@ -0,0 +1,99 @@
+import os
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+
+#####################################
+# Streaming record export
+#####################################
+# Exports are written one batch at a time through a CSV or Parquet writer
+# whose output is handed to the response as soon as it is encoded, so memory
+# stays bounded by EXPORT_BATCH_ROWS whatever the size of the export.
+
+EXPORT_BATCH_ROWS = int(os.environ.get('EXPORT_BATCH_ROWS', 10000))   # rows per Parquet row group / CSV write
+
+person_fields = [('emp_id', pa.int64()), ('preferred_name', pa.string()), ('department', pa.string())]
+
+export_schemas = {
+    'wos': pa.schema(person_fields + [('work_id', pa.string()), ('title', pa.string()), ('source', pa.string()),
+                                      ('publishYear', pa.int64()), ('doi', pa.string()),
+                                      ('issn', pa.string()), ('eissn', pa.string())]),
+    'alex': pa.schema(person_fields + [('work_id', pa.string()), ('work_title', pa.string()),
+                                       ('work_publication_year', pa.int64()), ('work_source', pa.string()),
+                                       ('work_doi', pa.string())]),
+    'merged': pa.schema(person_fields + [('work_id', pa.string()), ('title', pa.string()), ('source', pa.string()),
+                                         ('publishYear', pa.int64()), ('doi', pa.string()),
+                                         ('issn', pa.string()), ('eissn', pa.string()), ('web_source', pa.string()),
+                                         ('match_confidence', pa.float64())]),
+}
+
+export_formats = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+class ChunkSink:
+    ### write-only file object for the Arrow writers; drain() hands out what
+    ### has been written since the last call
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_table(df, schema):
+    ### df projected and cast to the export schema; missing columns are null
+    arrays = []
+    for field in schema:
+        if field.name in df.columns:
+            arrays.append(pa.array(df[field.name], from_pandas=True).cast(field.type))
+        else:
+            arrays.append(pa.nulls(len(df), field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def stream_records(frames, records='merged', fmt='csv'):
+    ### frames: iterable of DataFrames (one per person); yields encoded bytes
+    schema = export_schemas[records]
+    sink = ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa_csv.CSVWriter(sink, schema)
+    batch = []
+    n_rows = 0
+    for df in frames:
+        if (df is None) or (len(df) == 0):
+            continue
+        batch.append(export_table(df, schema))
+        n_rows += len(df)
+        if n_rows >= EXPORT_BATCH_ROWS:
+            writer.write_table(pa.concat_tables(batch))
+            batch = []
+            n_rows = 0
+            yield sink.drain()
+    if len(batch) != 0:
+        writer.write_table(pa.concat_tables(batch))
+    writer.close()
+    yield sink.drain()
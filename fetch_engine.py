@@ -0,0 +1,391 @@
+import os
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from record_cache import get_cached_records, cache_get, entry_min_year
+from http_client import get_json, call_wos, FetchError, HTTP_POOL_SIZE, OPENALEX_API_KEY
+from aggregates import update_person_counts
+from metrics import span
+from records import WorkBuffer, concat_records, wos_schema, alex_schema
+
+first_year = 1985    # earliest year offered by the dashboard
+usd_alex_id = "https://openalex.org/I160856358"
+wos_columns = list(wos_schema)
+alex_columns = list(alex_schema)
+
+### API endpoints; the benchmarks point these at local stand-in servers
+WOS_API_HOST = os.environ.get('WOS_API_HOST', 'https://api.clarivate.com/apis/wos-starter/v1')
+OPENALEX_API_URL = os.environ.get('OPENALEX_API_URL', 'https://api.openalex.org')
+
+#####################################
+# load_dotenv()
+import clarivate.wos_starter.client
+api = '1228ec5f8a29051d5dd8a7fbbd01a114d6de7ef1'
+configuration = clarivate.wos_starter.client.Configuration(
+    host = WOS_API_HOST
+)
+configuration.api_key['ClarivateApiKeyAuth'] = api
+configuration.connection_pool_maxsize = HTTP_POOL_SIZE
+api_inst= clarivate.wos_starter.client.DocumentsApi(clarivate.wos_starter.client.ApiClient(configuration))
+#####################################
+
+### max requests in flight per harvest (one fetch_emp_records call), across
+### all its sources, author ids and pages; never more than the connection pool
+FETCH_CONCURRENCY = min(int(os.environ.get('FETCH_CONCURRENCY', 8)), HTTP_POOL_SIZE)
+
+
+def iter_concurrently(fn, args_in, max_workers=None):
+    ### Run fn over args_in on a bounded thread pool, yielding results in input
+    ### order as soon as each one (and the ones before it) is ready
+    args_in = list(args_in)
+    if len(args_in) == 0:
+        return
+    if len(args_in) == 1:
+        yield fn(args_in[0])
+        return
+    if max_workers is None:
+        max_workers = FETCH_CONCURRENCY
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(args_in))) as pool:
+        yield from pool.map(fn, args_in)
+
+
+def run_concurrently(fn, args_in, max_workers=None):
+    return list(iter_concurrently(fn, args_in, max_workers))
+
+
+class FetchProgress:
+    ### Pages fetched / expected per source and the sources already written to
+    ### the store for one fetch_emp_records call. callback(progress) runs after
+    ### every change, on whichever worker thread made it.
+    ### requests is the harvest's one bound on requests in flight: the thread
+    ### pools for sources, author ids and pages nest, so every remote request
+    ### holds a slot while it runs, and nothing holds one while it waits on a pool.
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.pages = {}
+        self.stored = []
+        self.lock = threading.Lock()
+        self.requests = threading.BoundedSemaphore(FETCH_CONCURRENCY)
+
+    def expect(self, source, n_pages):
+        with self.lock:
+            self.pages.setdefault(source, [0, 0])[1] += n_pages
+        self._report()
+
+    def page_done(self, source):
+        with self.lock:
+            self.pages.setdefault(source, [0, 0])[0] += 1
+        self._report()
+
+    def source_stored(self, source):
+        with self.lock:
+            self.stored.append(source)
+        self._report()
+
+    def fraction(self):
+        with self.lock:
+            done = sum(n_done for n_done, n_total in self.pages.values())
+            total = sum(n_total for n_done, n_total in self.pages.values())
+        ### the cursor path makes one request more than the page estimate
+        return min(done/total, 1) if total!=0 else 0
+
+    def _report(self):
+        if self.callback is not None:
+            self.callback(self)
+
+
+def fetch_emp_records(author_record, min_year, max_age=None, progress=None):
+    ### WOS and OpenAlex records for one roster entry (roster.find_lookup_record).
+    ### Returns (df_wos, df_alex, errors): a source is None when the person has no
+    ### usable id for it or its harvest failed; errors maps the failed source to
+    ### its FetchError.
+    ### Both sources are harvested at the same time and each is stored as soon
+    ### as it is complete; progress (FetchProgress) follows the pages.
+    if progress is None:
+        progress = FetchProgress()
+    author_wos = author_record['wos_ids']
+    author_alex = author_record['alex_ids'][0] if len(author_record['alex_ids'])!=0 else None
+    sources = []
+    if (len(author_wos)!=0) and (None not in author_wos):
+        sources.append(('wos', lambda: create_record_tbl(author_wos, api_inst, min_year, max_age, progress)))
+    if author_alex != None:
+        sources.append(('alex', lambda: create_record_tbl_alex(author_alex, min_year, max_age, progress)))
+
+    def fetch_source(source_fn):
+        source, fn = source_fn
+        try:
+            df = fn()
+        except FetchError as e:
+            return None, e
+        progress.source_stored(source)
+        return df, None
+
+    results = dict(zip([source for source, _ in sources], run_concurrently(fetch_source, sources)))
+    df_wos, wos_error = results.get('wos', (None, None))
+    df_alex, alex_error = results.get('alex', (None, None))
+    errors = {source: e for source, e in (('wos', wos_error), ('alex', alex_error)) if e is not None}
+    ### keep the department / college count matrix in step with the store
+    if len(errors)==0:
+        ### a cached entry may reach back before min_year, the counts cover its whole history
+        floor = stored_min_year(author_record)
+        update_person_counts(author_record['emp_id'], df_wos, df_alex, floor if floor is not None else min_year)
+    return df_wos, df_alex, errors
+
+def read_emp_records(author_record):
+    ### Local read of what fetch_emp_records stored, without any API call.
+    ### Returns (df_wos, df_alex); a source is None when nothing is stored.
+    df_wos = None
+    df_alex = None
+    author_wos = author_record['wos_ids']
+    if (len(author_wos)!=0) and (None not in author_wos):
+        hits = [cache_get('wos', author_wos_id) for author_wos_id in author_wos]
+        hits = [hit[0] for hit in hits if hit is not None]
+        if len(hits)!=0:
+            df_wos = concat_records(hits)
+    author_alex = author_record['alex_ids'][0] if len(author_record['alex_ids'])!=0 else None
+    if author_alex != None:
+        hit = cache_get('alex', author_alex)
+        if hit is not None:
+            df_alex = hit[0]
+    return df_wos, df_alex
+
+def stored_min_year(author_record):
+    ### Year the stored records of every source reach back to, i.e. the latest
+    ### floor among the person's entries; None when nothing is stored. Counts
+    ### built from read_emp_records are complete from this year on.
+    floors = []
+    author_wos = author_record['wos_ids']
+    if (len(author_wos)!=0) and (None not in author_wos):
+        floors += [entry_min_year('wos', author_wos_id) for author_wos_id in author_wos]
+    if len(author_record['alex_ids'])!=0:
+        floors.append(entry_min_year('alex', author_record['alex_ids'][0]))
+    floors = [floor for floor in floors if floor is not None]
+    return max(floors) if len(floors)!=0 else None
+
+### fetch_fn per source for record_cache.get_cached_records, one author id at a time
+source_fetchers = {
+    'wos': lambda author_id, since, min_year: fetch_record_tbl(author_id, api_inst, since, min_year),
+    'alex': lambda author_id, since, min_year: fetch_record_tbl_alex(author_id, since, min_year),
+}
+
+def create_record_tbl_alex(author_id_in, min_year, max_age=None, progress=None):
+    return get_cached_records('alex', author_id_in,
+                              lambda alex_id, since, year: fetch_record_tbl_alex(alex_id, since, year, progress),
+                              min_year, max_age)
+
+def fetch_record_tbl_alex(author_id_in, since=None, min_year=None, progress=None):
+    ### OpenAlex records
+    ### since: only works updated on or after this date (delta refresh); the
+    ### filter needs an OpenAlex Premium key, without one the refresh is a
+    ### full harvest rather than a rejected request followed by one
+    ### min_year: only works published in this year or later
+    if not OPENALEX_API_KEY:
+        since = None
+    return get_open_alex_data_ai(author_id_in, since, min_year, progress)
+
+def create_record_tbl(author_id_in, api_param_in, min_year, max_age=None, progress=None):
+    ### WOS records, cached per WOS author id; author ids are fetched in parallel
+    pub_df = run_concurrently(lambda author_wos_id: get_cached_records('wos', author_wos_id,
+                                  lambda wos_id, since, year: fetch_record_tbl(wos_id, api_param_in, since, year, progress),
+                                  min_year, max_age),
+                              author_id_in)
+    ### a work listed under several of the author's WOS ids is kept once
+    pub_df = concat_records(pub_df)
+    return pub_df
+
+def fetch_record_tbl(author_wos_id, api_param_in, since=None, min_year=None, progress=None):
+    ### WOS records for a single author id
+    ### since: only records modified on or after this date (delta refresh)
+    ### min_year: only records published in this year or later
+    if progress is None:
+        progress = FetchProgress()
+    modified_time_span = None
+    if since is not None:
+        modified_time_span = f'{since.isoformat()}+{datetime.date.today().isoformat()}'
+    with progress.requests:
+        rec1_df = get_wos_data_ai(api_param_in, 1, author_wos_id, modified_time_span, min_year).to_dict()
+    n_records = rec1_df['metadata']['total']
+    n_limit = rec1_df['metadata']['limit']
+    ### page 1 is reused, the remaining pages are requested in parallel
+    n_pages = -(-n_records//n_limit)
+    progress.expect('wos', max(n_pages, 1))
+    progress.page_done('wos')
+
+    def fetch_page(page_n):
+        with progress.requests:
+            page = get_wos_data_ai(api_param_in, page_n, author_wos_id, modified_time_span, min_year).to_dict()
+        progress.page_done('wos')
+        return page
+
+    if since is None:
+        pages = [rec1_df] + run_concurrently(fetch_page, range(2, n_pages+1))
+    else:
+        ### delta: pages come newest load first (LD+D), so paging stops at the
+        ### first page holding only works already stored, i.e. loaded before
+        ### the mark. Edits to older records past that page are picked up by
+        ### the periodic full refresh in sync.py.
+        stored = cache_get('wos', author_wos_id, columns=['work_id'])
+        known = set(stored[0]['work_id']) if stored is not None else set()
+        pages = [rec1_df]
+        page_n = 2
+        while (page_n <= n_pages) and any(hit['uid'].split(':')[1] not in known for hit in pages[-1]['hits']):
+            pages.append(fetch_page(page_n))
+            page_n += 1
+    with span('parse', source='wos'):
+        pub_df = parse_wos_pages(pages)
+    return pub_df
+
+def parse_wos_pages(pages):
+    buf = WorkBuffer('wos')
+    for rec1_df in pages:
+        for index in range(len(rec1_df['hits'])):
+            if 'doi' in rec1_df['hits'][index]['identifiers']:
+                doi = rec1_df['hits'][index]['identifiers']['doi']
+            else:
+                doi = None
+            if 'issn' in rec1_df['hits'][index]['identifiers']:
+                issn = rec1_df['hits'][index]['identifiers']['issn']
+            else:
+                issn = None
+            if 'eissn' in rec1_df['hits'][index]['identifiers']:
+                eissn = rec1_df['hits'][index]['identifiers']['eissn']
+            else:
+                eissn = None
+            buf.append(rec1_df['hits'][index]['uid'].split(':')[1],
+                       rec1_df['hits'][index]['title'],
+                       rec1_df['hits'][index]['source']['sourceTitle'],
+                       rec1_df['hits'][index]['source']['publishYear'],
+                       doi,
+                       issn,
+                       eissn)
+    return buf.to_frame()
+
+def get_wos_data_au(api_instance, page_n, author):
+    q = f'AU={author} AND OG=University of San Diego AND PY=(2000-{datetime.datetime.now().year})' # str | Web of Science advanced [advanced search query builder](https://webofscience.help.clarivate.com/en-us/Content/advanced-search.html). The supported field tags are listed in description.
+    db = 'WOS' # str | Web of Science Database abbreviation * WOS - Web of Science Core collection * BIOABS - Biological Abstracts * BCI - BIOSIS Citation Index * BIOSIS - BIOSIS Previews * CCC - Current Contents Connect * DIIDW - Derwent Innovations Index * DRCI - Data Citation Index * MEDLINE - MEDLINE The U.S. National Library of Medicine® (NLM®) premier life sciences database. * ZOOREC - Zoological Records * PPRN - Preprint Citation Index * WOK - All databases  (optional) (default to 'WOS')
+    limit = 50 # int | set the limit of records on the page (1-50) (optional) (default to 10)
+    page = page_n # int | set the result page (optional) (default to 1)
+    sort_field = 'LD+D' # str | Order by field(s). Field name and order by clause separated by '+', use A for ASC and D for DESC, ex: PY+D. Multiple values are separated by comma. Supported fields:  * **LD** - Load Date * **PY** - Publication Year * **RS** - Relevance * **TC** - Times Cited  (optional)
+    modified_time_span = None # str | Defines a date range in which the results were most recently modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
+    tc_modified_time_span = None # str | Defines a date range in which times cited counts were modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
+    detail = None # str | it will returns the full data by default, if detail=short it returns the limited data (optional)
+
+    # Query Web of Science documents; raises FetchError once retries are exhausted
+    api_response = call_wos(api_instance.documents_get, q, db=db, limit=limit, page=page, sort_field=sort_field, modified_time_span=modified_time_span, tc_modified_time_span=tc_modified_time_span, detail=detail)
+    return api_response
+    
+def get_wos_data_ai(api_instance, page_n, author_id, modified_time_span=None, min_year=None):
+    ### the upper bound is next year, taken at call time: early-access records
+    ### already carry next year's PY and long-running workers cross New Year
+    q = f'AI={author_id}' if min_year is None else f'AI={author_id} AND PY=({min_year}-{datetime.datetime.now().year+1})' # str | Web of Science advanced [advanced search query builder](https://webofscience.help.clarivate.com/en-us/Content/advanced-search.html). The supported field tags are listed in description.
+    db = 'WOS' # str | Web of Science Database abbreviation * WOS - Web of Science Core collection * BIOABS - Biological Abstracts * BCI - BIOSIS Citation Index * BIOSIS - BIOSIS Previews * CCC - Current Contents Connect * DIIDW - Derwent Innovations Index * DRCI - Data Citation Index * MEDLINE - MEDLINE The U.S. National Library of Medicine® (NLM®) premier life sciences database. * ZOOREC - Zoological Records * PPRN - Preprint Citation Index * WOK - All databases  (optional) (default to 'WOS')
+    limit = 50 # int | set the limit of records on the page (1-50) (optional) (default to 10)
+    page = page_n # int | set the result page (optional) (default to 1)
+    sort_field = 'LD+D' # str | Order by field(s). Field name and order by clause separated by '+', use A for ASC and D for DESC, ex: PY+D. Multiple values are separated by comma. Supported fields:  * **LD** - Load Date * **PY** - Publication Year * **RS** - Relevance * **TC** - Times Cited  (optional)
+    # modified_time_span: str | Defines a date range in which the results were most recently modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
+    tc_modified_time_span = None # str | Defines a date range in which times cited counts were modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
+    detail = None # str | it will returns the full data by default, if detail=short it returns the limited data (optional)
+
+    # Query Web of Science documents; raises FetchError once retries are exhausted
+    api_response = call_wos(api_instance.documents_get, q, db=db, limit=limit, page=page, sort_field=sort_field, modified_time_span=modified_time_span, tc_modified_time_span=tc_modified_time_span, detail=detail)
+    return api_response
+
+def get_open_alex_data_ai(id_in, since=None, min_year=None, progress=None):
+    ### Works the author published with a USD affiliation, parsed page by page
+    ### as the pages arrive
+    return parse_open_alex_works(iter_open_alex_pages(id_in, since, min_year, progress), id_in).to_frame()
+
+def iter_open_alex_pages(id_in, since=None, min_year=None, progress=None):
+    ### author, institution and year are filtered by OpenAlex, so only the
+    ### author's works with a USD affiliation are paged
+    filtered_works_url = f'{OPENALEX_API_URL}/works?filter=author.id:{id_in},authorships.institutions.id:I160856358'
+    if min_year is not None:
+        filtered_works_url = f'{filtered_works_url},publication_year:>{min_year-1}'
+    if since is not None:
+        filtered_works_url = f'{filtered_works_url},from_updated_date:{since.isoformat()}'
+
+    select = ",".join((
+        'id',
+        'ids',
+        'title',
+        'display_name',
+        'publication_year',
+        'publication_date',
+        'primary_location',
+        'open_access',
+        'authorships',
+        'cited_by_count',
+        'is_retracted',
+        'is_paratext',
+        'updated_date',
+        'created_date',
+    ))
+    per_page = 200   # OpenAlex maximum
+    works_url = f'{filtered_works_url}&select={select}&per-page={per_page}'
+
+    if progress is None:
+        progress = FetchProgress()
+
+    def fetch_page(page_url):
+        with progress.requests:
+            return get_json(page_url)
+
+    # first page gives the total count; it is kept rather than requested again
+    try:
+        page_with_results = fetch_page(f'{works_url}&page=1')
+    except FetchError as e:
+        if (since is None) or (e.status not in (400, 403)):
+            raise
+        ### updated-date filter rejected: fall back to a full harvest; a
+        ### 429 is raised, a full harvest would only send more requests
+        yield from iter_open_alex_pages(id_in, None, min_year, progress)
+        return
+    n_pages = -(-page_with_results['meta']['count']//per_page)
+    progress.expect('alex', max(n_pages, 1))
+    progress.page_done('alex')
+    yield page_with_results['results']
+
+    if n_pages*per_page <= 10000:
+        # request the remaining pages in parallel
+        for results in iter_concurrently(lambda page_n: fetch_page(f'{works_url}&page={page_n}')['results'],
+                                         range(2, n_pages+1)):
+            progress.page_done('alex')
+            yield results
+    else:
+        # page numbers stop at 10,000 results: follow the cursor instead,
+        # skipping the works already returned with page 1
+        seen = {work['id'] for work in page_with_results['results']}
+        cursor_alex = '*'
+        while cursor_alex:
+            page_with_results = fetch_page(f'{works_url}&cursor={cursor_alex}')
+            cursor_alex = page_with_results['meta']['next_cursor']
+            results = [work for work in page_with_results['results'] if work['id'] not in seen]
+            progress.page_done('alex')
+            yield results
+
+def parse_open_alex_works(pages, id_in, institution_id=usd_alex_id):
+    ### Keep only the requested author's authorship and only works where that
+    ### authorship lists the institution; other authorships are never expanded
+    author_key = 'https://openalex.org/'+id_in
+    buf = WorkBuffer('alex')
+    for results in pages:
+        ### pages arrive lazily, so only the parsing itself is timed
+        with span('parse', source='alex'):
+            parse_open_alex_page(buf, results, author_key, institution_id)
+    return buf
+
+def parse_open_alex_page(buf, results, author_key, institution_id):
+    for work in results:
+        if work['publication_year'] is None:
+            continue
+        for authorship in work['authorships']:
+            if (not authorship) or (not authorship['author']) or (authorship['author']['id'] != author_key):
+                continue
+            if any(institution and institution['id']==institution_id for institution in authorship['institutions']):
+                location = work['primary_location']
+                source = location['source'] if location else None
+                buf.append(work['id'], work['title'], work['publication_year'],
+                           source['display_name'] if source else None,
+                           (work['ids'] or {}).get('doi'))
+            break
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from roster import emp_by_id
+from fetch_engine import fetch_emp_records, first_year
+
+
+#####################################
+# Offline bulk harvester
+#####################################
+# Harvests WOS and OpenAlex works for every employee in the roster into the
+# local publication store (record_cache) that the dashboard reads from, so
+# dashboard views are local reads. Meant to run from cron, e.g.
+#
+#     python harvest.py --workers 4
+#
+# Progress is checkpointed after every employee; --resume skips the employees
+# already finished by an interrupted run.
+
+CHECKPOINT_PATH = os.environ.get('HARVEST_CHECKPOINT_PATH', 'Data/harvest_checkpoint.json')
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    ### write then rename, so an interrupted run never leaves a partial file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def harvest_employee(emp_id, min_year, max_age):
+    author_record = emp_by_id[emp_id]
+    df_wos, df_alex, errors = fetch_emp_records(author_record, min_year, max_age)
+    n_wos = len(df_wos) if df_wos is not None else 0
+    n_alex = len(df_alex) if df_alex is not None else 0
+    return n_wos, n_alex, {source: str(e) for source, e in errors.items()}
+
+
+def harvest_roster(workers=4, min_year=first_year, resume=False, force=False, checkpoint_path=CHECKPOINT_PATH):
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if (checkpoint is None) or (checkpoint['min_year'] != min_year):
+        checkpoint = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'min_year': min_year, 'done': [], 'failed': {}}
+    done = set(checkpoint['done'])
+    todo = [emp_id for emp_id, record in emp_by_id.items()
+            if (emp_id not in done) and (len(record['wos_ids'])!=0 or len(record['alex_ids'])!=0)]
+    print(f'harvesting {len(todo)} employees ({len(done)} already done) with {workers} workers')
+
+    ### force refreshes every entry through the incremental (delta) path
+    max_age = 0 if force else None
+    lock = threading.Lock()
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(harvest_employee, emp_id, min_year, max_age): emp_id for emp_id in todo}
+        for n, future in enumerate(as_completed(futures), start=1):
+            emp_id = futures[future]
+            name = emp_by_id[emp_id]['preferred_name']
+            try:
+                n_wos, n_alex, errors = future.result()
+            except Exception as e:
+                n_wos, n_alex, errors = 0, 0, {'error': repr(e)}
+            with lock:
+                if errors:
+                    checkpoint['failed'][str(emp_id)] = errors
+                else:
+                    checkpoint['failed'].pop(str(emp_id), None)
+                    checkpoint['done'].append(emp_id)
+                save_checkpoint(checkpoint_path, checkpoint)
+            status = f'failed: {errors}' if errors else f'{n_wos} WOS, {n_alex} OpenAlex'
+            print(f'[{n}/{len(todo)}] {name}: {status} ({time.time()-t0:.0f}s)')
+    print(f'done. {len(checkpoint["done"])} employees harvested, {len(checkpoint["failed"])} failed')
+    return checkpoint
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Harvest WOS and OpenAlex records for the whole roster.')
+    parser.add_argument('--workers', type=int, default=4, help='employees harvested in parallel')
+    parser.add_argument('--min-year', type=int, default=first_year, help='earliest publication year to harvest')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run from its checkpoint')
+    parser.add_argument('--force', action='store_true', help='refresh entries that are still within the cache TTL')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH, help='checkpoint file')
+    args = parser.parse_args()
+    harvest_roster(args.workers, args.min_year, args.resume, args.force, args.checkpoint)
@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+
+from clarivate.wos_starter.client.rest import ApiException
+
+from metrics import inc, span
+from record_cache import CACHE_PATH
+
+
+#####################################
+# Shared HTTP client
+#####################################
+# One pooled keep-alive session per worker process, a token bucket per remote
+# host shared by all processes, and retries with jittered exponential backoff
+# on 429/5xx. Every call carries a timeout so a slow upstream cannot hold a
+# worker indefinitely.
+
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 30))          # seconds per request
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 4))             # retries after the first attempt
+HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.5))         # base backoff in seconds
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 30))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))        # keep-alive connections per host
+
+# OpenAlex polite pool: 10 requests/second with a contact address
+OPENALEX_RATE = float(os.environ.get('OPENALEX_RATE', 10))
+OPENALEX_MAILTO = os.environ.get('OPENALEX_MAILTO')
+# OpenAlex Premium key; the updated-date filter behind delta refreshes needs one
+OPENALEX_API_KEY = os.environ.get('OPENALEX_API_KEY')
+# WOS Starter: per-second limit of the subscription
+WOS_RATE = float(os.environ.get('WOS_RATE', 5))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    def __init__(self, host, status, message):
+        super().__init__(f'{host}: {status} {message}')
+        self.host = host
+        self.status = status
+
+
+class TokenBucket:
+    ### rate tokens per second, up to burst tokens saved up. The bucket is a
+    ### row in the record store's SQLite index, so every gunicorn worker and
+    ### background job process draws from one limit per host. A take reserves
+    ### the next slot in one write transaction and sleeps until it comes up.
+    def __init__(self, host, rate, burst=None):
+        self.host = host
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+
+    def _connect(self):
+        con = sqlite3.connect(CACHE_PATH, timeout=30, isolation_level=None)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('''CREATE TABLE IF NOT EXISTS rate_buckets (
+                           host TEXT PRIMARY KEY,
+                           tokens REAL NOT NULL,
+                           updated REAL NOT NULL)''')
+        return con
+
+    def take(self):
+        con = self._connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            row = con.execute('SELECT tokens, updated FROM rate_buckets WHERE host=?', (self.host,)).fetchone()
+            now = time.time()
+            tokens = self.burst if row is None else min(self.burst, row[0] + max(0, now - row[1])*self.rate)
+            tokens -= 1
+            con.execute('INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)', (self.host, tokens, now))
+            con.execute('COMMIT')
+        finally:
+            con.close()
+        if tokens < 0:
+            time.sleep(-tokens/self.rate)
+
+
+buckets = {
+    'openalex': TokenBucket('openalex', OPENALEX_RATE),
+    'wos': TokenBucket('wos', WOS_RATE),
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    ### sessions are not shared across forked gunicorn workers
+    global _session, _session_pid
+    with _session_lock:
+        if (_session is None) or (_session_pid != os.getpid()):
+            _session = requests.Session()
+            ### parallel harvests (harvest.py --workers) share the pool: a
+            ### request waits for a free connection rather than opening one
+            ### that is thrown away afterwards
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF*2**attempt))
+
+
+def get_json(url, host='openalex', params=None):
+    if (host == 'openalex') and OPENALEX_MAILTO:
+        params = dict(params or {}, mailto=OPENALEX_MAILTO)
+    if (host == 'openalex') and OPENALEX_API_KEY:
+        params = dict(params or {}, api_key=OPENALEX_API_KEY)
+    for attempt in range(HTTP_RETRIES+1):
+        buckets[host].take()
+        inc('dashboard_remote_calls_total', host=host)
+        try:
+            with span('remote_page', host=host):
+                resp = get_session().get(url, params=params, timeout=HTTP_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == HTTP_RETRIES:
+                inc('dashboard_remote_errors_total', host=host)
+                raise FetchError(host, None, str(e))
+            inc('dashboard_remote_retries_total', host=host)
+            time.sleep(backoff_delay(attempt))
+            continue
+        inc('dashboard_remote_bytes_total', len(resp.content), host=host)
+        if (resp.status_code in RETRY_STATUS) and (attempt < HTTP_RETRIES):
+            inc('dashboard_remote_retries_total', host=host)
+            time.sleep(backoff_delay(attempt, resp.headers.get('Retry-After')))
+            continue
+        if resp.status_code >= 400:
+            inc('dashboard_remote_errors_total', host=host)
+            raise FetchError(host, resp.status_code, resp.text[:200])
+        return resp.json()
+
+
+def call_wos(fn, *args, **kwargs):
+    ### fn is a WOS Starter client method such as DocumentsApi.documents_get
+    kwargs.setdefault('_request_timeout', HTTP_TIMEOUT)
+    for attempt in range(HTTP_RETRIES+1):
+        buckets['wos'].take()
+        inc('dashboard_remote_calls_total', host='wos')
+        try:
+            ### the generated client returns parsed models, so response bytes
+            ### are only counted for OpenAlex
+            with span('remote_page', host='wos'):
+                return fn(*args, **kwargs)
+        except ApiException as e:
+            if (e.status not in RETRY_STATUS) or (attempt == HTTP_RETRIES):
+                inc('dashboard_remote_errors_total', host='wos')
+                raise FetchError('wos', e.status, e.reason)
+            inc('dashboard_remote_retries_total', host='wos')
+            retry_after = e.headers.get('Retry-After') if getattr(e, 'headers', None) else None
+            time.sleep(backoff_delay(attempt, retry_after))
+        except urllib3.exceptions.HTTPError as e:
+            if attempt == HTTP_RETRIES:
+                inc('dashboard_remote_errors_total', host='wos')
+                raise FetchError('wos', None, str(e))
+            inc('dashboard_remote_retries_total', host='wos')
+            time.sleep(backoff_delay(attempt))
@@ -1,18 +1,35 @@
 import os
+import re
 import pandas as pd
 from dotenv import load_dotenv
-import requests
 import datetime
+import time
+import functools
 import numpy as np
 
+import flask
 import dash
-from dash import html, dcc, Input, Output
+from dash import html, dcc, Input, Output, State, DiskcacheManager
+import diskcache
 import dash_bootstrap_components as dbc
 from dash import dash_table
 
+from fetch_engine import FetchProgress, fetch_emp_records, read_emp_records, first_year, wos_columns, alex_columns
+from matching import match_records
+from records import key_columns
+from aggregates import rollup
+from metrics import span, flush, install
+from export import stream_records, export_schemas, export_formats
+
 current_year = datetime.datetime.now().year
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+### Harvests run as background callbacks in worker processes managed through a
+### local diskcache directory; no external broker is needed
+JOB_CACHE_DIR = os.environ.get('JOB_CACHE_DIR', 'Data/job_cache')
+background_callback_manager = DiskcacheManager(diskcache.Cache(JOB_CACHE_DIR))
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True,
+                background_callback_manager=background_callback_manager)
 # app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
 
@@ -20,25 +37,8 @@ app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_
 # # Add your data
 # #####################################
 
-CAS  = pd.read_pickle("Data/CAS_mod.pkl")
-CAS.columns = CAS.columns.str.lower()
-search_words = ['Professor', 'Assistant Professor', 'Associate Professor', 'Lecturer']
-pattern = '|'.join(search_words)
-emp = CAS[CAS['position'].str.contains(pattern, case=False, na=False)]
-
-id_lookup = pd.read_pickle("Data/id_lookup.pkl")
+from roster import emp, emp_by_id, emp_by_name, find_lookup_record, search_employees, search_text
 
-#####################################
-# load_dotenv()
-import clarivate.wos_starter.client
-from clarivate.wos_starter.client.rest import ApiException
-api = '1228ec5f8a29051d5dd8a7fbbd01a114d6de7ef1'
-configuration = clarivate.wos_starter.client.Configuration(
-    host = "https://api.clarivate.com/apis/wos-starter/v1"
-)
-configuration.api_key['ClarivateApiKeyAuth'] = api
-api_inst= clarivate.wos_starter.client.DocumentsApi(clarivate.wos_starter.client.ApiClient(configuration))
-#####################################
 
 
 #####################################
@@ -77,27 +77,49 @@ SIDEBAR_STYLE = {
 #####################################
 
 
-sidebar = html.Div(
-    [
-        html.H5("Search employee records", className="display-10",style={'textAlign':'center'}),
-        html.Hr(),
-        html.P(
-            "Employee:", className="lead"
-        ),
-        dcc.Dropdown(
-                        id="employee_input_value",
-                        options=emp['preferred_name'].to_list(),
-                        value=emp['preferred_name'].to_list()[0],
-                    ),
-        dcc.Dropdown(
-                        id="min_year_select",
-                        options = np.arange(1985, current_year+1).tolist(),
-                        value = 2000,
-                    ),      
-        html.Hr(),
-    ],
-    style=SIDEBAR_STYLE,
-)
+EMPLOYEE_SEARCH_LIMIT = 20    # typeahead matches sent to the browser
+
+def employee_option(emp_id):
+    ### search holds everything the server matched on, so the dropdown's own
+    ### filter keeps the option
+    record = emp_by_id[emp_id]
+    label = record['preferred_name'] if not isinstance(record['department'], str) \
+        else f"{record['preferred_name']} ({record['department']})"
+    return {'label': label, 'value': record['preferred_name'], 'search': search_text(record)}
+
+default_employee = emp['preferred_name'].to_list()[0]
+
+def make_sidebar():
+    return html.Div(
+        [
+            html.H5("Search employee records", className="display-10",style={'textAlign':'center'}),
+            html.Hr(),
+            html.P(
+                "Employee:", className="lead"
+            ),
+            dcc.Dropdown(
+                            id="employee_input_value",
+                            options=[employee_option(emp_by_name[default_employee])],
+                            value=default_employee,
+                            placeholder="Type a name, department or position",
+                            clearable=False,
+                        ),
+            dcc.Dropdown(
+                            id="min_year_select",
+                            options = np.arange(first_year, current_year+1).tolist(),
+                            value = 2000,
+                        ),      
+            html.Hr(),
+            dbc.Progress(id="fetch_progress", value=0, style={'visibility': 'hidden'}),
+            html.Small(id="fetch_status"),
+            html.Div(html.Small(id="fetch_errors", className="text-danger")),
+            dcc.Store(id="emp_records"),
+            dcc.Store(id="emp_partial"),
+            dcc.Store(id="fetch_request"),
+            dcc.Store(id="fetch_stored"),
+        ],
+        style=SIDEBAR_STYLE,
+    )
 
 
 #####################################
@@ -107,11 +129,34 @@ sidebar = html.Div(
 ### Layout 1
 layout1 = html.Div([html.Div(id="emp_info2"),  html.Div([html.H4("Results below:"), html.Hr()]), html.Div(id="emp_info1")])
 
-layout2 = html.Div(id="emp_table_tab1")
+### Publication tables are paged, sorted and filtered on the server
+PAGE_SIZE = 25
 
-layout3 = html.Div(id="emp_table_tab2")
+def paged_table(table_id):
+    return dash_table.DataTable(id=table_id, data=[], columns=[],
+                                page_current=0, page_size=PAGE_SIZE, page_action='custom',
+                                sort_action='custom', sort_mode='multi', sort_by=[],
+                                filter_action='custom', filter_query='',
+                                row_selectable="multi",editable=False,
+                                style_data={'whiteSpace': 'normal', 'height': 'auto'})
+
+layout2 = html.Div(paged_table("wos_table"), id="emp_table_tab1")
+
+layout3 = html.Div(paged_table("alex_table"), id="emp_table_tab2")
 
-layout4 = html.Div(id="emp_summary")
+layout4 = html.Div(paged_table("common_table"), id="emp_summary")
+
+### Department / college roll-up
+layout5 = html.Div([dbc.Row([dbc.Col(dcc.Dropdown(id="group_level",
+                                                  options=[{'label': 'Department', 'value': 'department'},
+                                                           {'label': 'College', 'value': 'college'}],
+                                                  value='department', clearable=False), width=3),
+                             dbc.Col(dcc.Dropdown(id="group_value"), width=6)]),
+                    html.Hr(),
+                    html.Div(id="group_info"),
+                    html.Div(id="group_by_year"),
+                    html.Hr(),
+                    html.Div(id="group_breakdown")])
 
 content = html.Div([html.H1("Records"),
                     html.Hr(),
@@ -132,11 +177,19 @@ content = html.Div([html.H1("Records"),
                                     label = "Common List",
                                     value = 'tab-4',
                                     ),
+                            dcc.Tab(layout5,
+                                    label = "Departments",
+                                    value = 'tab-5',
+                                    ),
                                 ]),
                 ]
         )
 
-app.layout = html.Div([dbc.Col(sidebar), dbc.Col(content, style=CONTENT_STYLE, width=9)])
+### built per page load rather than at import
+def serve_layout():
+    return html.Div([dbc.Col(make_sidebar()), dbc.Col(content, style=CONTENT_STYLE, width=9)])
+
+app.layout = serve_layout
 
 
 ######################################################################
@@ -153,65 +206,256 @@ def render_content(tabX):
         return layout3
     elif tabX=="tab-4":
         return layout4
+    elif tabX=="tab-5":
+        return layout5
     else:
         return html.P("Error")
 
+@app.callback(Output('employee_input_value', 'options'),
+              [Input('employee_input_value', 'search_value')],
+              [State('employee_input_value', 'value')])
+def update_employee_options(search_value, value):
+    ### typeahead over the roster search index; the selected employee stays in
+    ### the options so the dropdown keeps showing it
+    emp_ids = search_employees(search_value, EMPLOYEE_SEARCH_LIMIT) if search_value else []
+    if (value is not None) and (emp_by_name[value] not in emp_ids):
+        emp_ids = [emp_by_name[value]] + emp_ids
+    return [employee_option(emp_id) for emp_id in emp_ids]
+
 @app.callback(Output('emp_info2', 'children'),
               [Input('employee_input_value', 'value')])
 def update_emp_info_page(value):
-    first_name = value.split(' ')[0]
-    last_name = value.split(' ')[1]
-    author_record = CAS[(CAS['first_name']==first_name) & (CAS['last_name']==last_name)]
-    author_record = author_record[['first_name','last_name','position','department','college']]
-    return dash_table.DataTable(author_record.to_dict('records'), [{"name": i, "id": i} for i in author_record.columns], 
+    if value is None:
+        return dash.no_update
+    author_record = find_lookup_record(value)
+    info_columns = ['first_name','last_name','position','department','college']
+    return dash_table.DataTable([{i: author_record[i] for i in info_columns}], [{"name": i, "id": i} for i in info_columns], 
                                 row_selectable="multi",editable=False, 
                                 style_data={'whiteSpace': 'normal', 'height': 'auto'})
 
-@app.callback(Output('emp_info1', 'children'),
+def fetch_status(progress):
+    pages = ', '.join(f"{'WOS' if source=='wos' else 'OpenAlex'} {n_done}/{n_total}"
+                      for source, (n_done, n_total) in sorted(progress.pages.items()))
+    return f'pages fetched: {pages}' if pages else 'fetching...'
+
+
+def covers(data, employee, min_year):
+    ### a fetch that failed for a source covers nothing, so it is tried again
+    return (data is not None) and (data['employee']==employee) and (data['min_year']<=min_year) \
+        and (not data.get('errors'))
+
+
+@app.callback(Output('fetch_request', 'data'),
               [Input('employee_input_value', 'value'),
-               Input('min_year_select', 'value')])
-def update_emp_summary_table(value, year_select):
-    author_record = find_lookup_record(value)
-    author_wos = author_record['wos_id'].to_list()
-    if len(author_wos)==0:
+               Input('min_year_select', 'value')],
+              [State('emp_records', 'data'),
+               State('fetch_request', 'data')])
+def request_fetch(value, year_select, data, last_request):
+    ### Runs in the web worker, so a selection the stored records already cover
+    ### (raising the year) never starts a background job. Going back to the
+    ### stored employee while another one is fetching still sends a request,
+    ### which replaces (and so terminates) the running job.
+    if value is None:
+        return dash.no_update
+    if year_select is None:
+        year_select = first_year
+    if covers(data, value, year_select) and ((last_request is None) or (last_request['employee']==value)):
+        return dash.no_update
+    return {'employee': value, 'min_year': year_select}
+
+
+@app.callback(Output('emp_records', 'data'),
+              [Input('fetch_request', 'data')],
+              [State('emp_records', 'data')],
+              background=True,
+              progress=[Output('fetch_progress', 'value'), Output('fetch_status', 'children'), Output('fetch_stored', 'data')],
+              running=[(Output('fetch_progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'})])
+def update_emp_records(set_progress, request, data):
+    ### Single fetch stage: WOS and OpenAlex are paged once per employee into
+    ### the local publication store; the browser only keeps the selection key
+    ### and every tab reads its slice on the server. Records are requested from
+    ### year_select onwards; raising the year only re-filters, lowering it
+    ### below the stored year fetches again.
+    ### Runs as a background job: every page updates the progress bar, and each
+    ### source is published through emp_partial as soon as it is stored, so the
+    ### OpenAlex tab fills in while WOS is still paging. Picking another name
+    ### while a job runs re-triggers this callback, and Dash terminates the
+    ### superseded job.
+    if request is None:
+        return dash.no_update
+    value = request['employee']
+    year_select = request['min_year']
+    if covers(data, value, year_select):
+        return dash.no_update
+    with span('lookup'):
+        author_record = find_lookup_record(value)
+    partial = {'employee': value, 'fetched_at': time.time(), 'stored': []}
+    set_progress((0, 'fetching...', dict(partial)))
+
+    def report(progress):
+        ### fetched_at only moves when a source has been stored; publish_partial
+        ### passes the selection on to the tables only then
+        if progress.stored != partial['stored']:
+            partial.update(fetched_at=time.time(), stored=list(progress.stored))
+        set_progress((int(100*progress.fraction()), fetch_status(progress), dict(partial)))
+
+    df_wos, df_alex, errors = fetch_emp_records(author_record, year_select, progress=FetchProgress(report))
+    ### job processes exit without running atexit handlers
+    flush()
+
+    ### failed sources are shown by show_fetch_errors; the tables keep what
+    ### the store already holds for them
+    return {'employee': value,
+            'min_year': year_select,
+            'fetched_at': time.time(),
+            'errors': {source: str(e) for source, e in errors.items()}}
+
+
+@app.callback(Output('fetch_errors', 'children'),
+              [Input('emp_records', 'data')])
+def show_fetch_errors(data):
+    if (data is None) or (not data.get('errors')):
+        return None
+    failed = ' and '.join('WOS' if source=='wos' else 'OpenAlex' for source in sorted(data['errors']))
+    return f'{failed} fetch failed; the tables show the records stored before.'
+
+
+@app.callback(Output('emp_partial', 'data'),
+              [Input('fetch_stored', 'data')],
+              [State('emp_partial', 'data')])
+def publish_partial(stored, partial):
+    ### progress outputs are re-applied on every page of a running job; the
+    ### summary and table callbacks only follow emp_partial, which changes once
+    ### per stored source
+    if (stored is None) or (stored == partial):
+        return dash.no_update
+    return stored
+
+
+@functools.lru_cache(maxsize=32)
+def selection_records(employee, fetched_at, year_select):
+    ### Per-selection result shared by the summary and table callbacks:
+    ### (df_wos, df_alex, unique_recs) after the year filter. fetched_at is
+    ### part of the key so a new fetch is never served from an older entry.
+    ### Missing sources are 0, as expected by find_common_records.
+    with span('lookup'):
+        author_record = find_lookup_record(employee)
+    with span('store_read'):
+        df_wos, df_alex = read_emp_records(author_record)
+    if df_wos is None:
         df_wos = 0
-    elif None not in author_wos:
-        df_wos = create_record_tbl(author_wos, api_inst)
-        df_wos = df_wos[df_wos['publishYear']>=year_select]
+    elif len(df_wos)!=0:
+        df_wos = df_wos[df_wos['publishYear']>=year_select].reset_index(drop=True)
+    if df_alex is None:
+        df_alex = 0
+    elif len(df_alex)!=0:
+        df_alex = df_alex[df_alex['work_publication_year']>=year_select].reset_index(drop=True)
+    with span('match'):
+        unique_recs = find_common_records(df_wos, df_alex)
+    return df_wos, df_alex, unique_recs
+
+
+def load_emp_records(data, partial, year_select, employee):
+    ### partial is the selection of a fetch still running; it wins over the last
+    ### finished one while it is newer and for the selected employee (a job
+    ### superseded by going back to the stored employee may have published one)
+    if (partial is not None) and (partial['employee']==employee) \
+            and ((data is None) or (partial['fetched_at'] > data['fetched_at'])):
+        data = partial
+    if data is None:
+        return 0, 0, 0
+    if year_select is None:
+        year_select = first_year
+    return selection_records(data['employee'], data['fetched_at'], year_select)
+
+
+### operator tokens of a DataTable filter_query clause, symbolic or spelled out
+filter_operators = {'ge': 'ge', '>=': 'ge', 'le': 'le', '<=': 'le', 'lt': 'lt', '<': 'lt', 'gt': 'gt', '>': 'gt',
+                    'ne': 'ne', '!=': 'ne', 'eq': 'eq', '=': 'eq', 'contains': 'contains',
+                    'datestartswith': 'datestartswith'}
+filter_clause = re.compile(r'^\{(.+?)\}\s+(\S+)\s+(.*)$')
+
+def split_filter_part(filter_part):
+    ### one clause of a DataTable filter_query, e.g. {publishYear} ge 2010
+    clause = filter_clause.match(filter_part.strip())
+    if (clause is None) or (clause.group(2) not in filter_operators):
+        return [None] * 3
+    name, operator, value_part = clause.groups()
+    value_part = value_part.strip()
+    v0 = value_part[0] if value_part else ''
+    if v0 and (len(value_part) > 1) and (v0 == value_part[-1]) and (v0 in ("'", '"', '`')):
+        value = value_part[1: -1].replace('\\' + v0, v0)
     else:
-        df_wos = 0
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return name, filter_operators[operator], value
+
+
+def page_table(df, page_current, page_size, sort_by, filter_query):
+    ### filter, sort and slice df on the server; returns (data, columns,
+    ### page_count, page_current) with page_current clamped to the pages of
+    ### this selection. The stored match keys are not shown
+    columns = [{"name": i, "id": i} for i in df.columns if i not in key_columns]
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            ### the value is coerced to the column's kind; a clause that cannot
+            ### be compared (text against a number column) is skipped
+            col = df[col_name]
+            if pd.api.types.is_numeric_dtype(col):
+                try:
+                    filter_value = float(filter_value)
+                except ValueError:
+                    continue
+            elif isinstance(filter_value, float):
+                col = pd.to_numeric(col.astype(object), errors='coerce')
+            else:
+                col = col.astype(str)
+            df = df.loc[getattr(col, operator)(filter_value)]
+        elif operator == 'contains':
+            df = df.loc[df[col_name].astype(str).str.contains(str(filter_value), case=False, regex=False)]
+        elif operator == 'datestartswith':
+            df = df.loc[df[col_name].astype(str).str.startswith(str(filter_value))]
+    ### sort_by is kept by the table across selections, and a placeholder
+    ### frame has none of the record columns
+    sort_by = [col for col in (sort_by or []) if col['column_id'] in df.columns]
+    if sort_by:
+        df = df.sort_values([col['column_id'] for col in sort_by],
+                            ascending=[col['direction'] == 'asc' for col in sort_by],
+                            inplace=False)
+    page_size = page_size or PAGE_SIZE
+    page_count = max(-(-len(df)//page_size), 1)
+    page_current = min(page_current or 0, page_count-1)
+    df = df.iloc[page_current*page_size: (page_current+1)*page_size]
+    df = df[[col['id'] for col in columns]]
+    with span('serialize'):
+        data = df.astype(object).where(df.notna(), None).to_dict('records')
+    return data, columns, page_count, page_current
+
+
+@app.callback(Output('emp_info1', 'children'),
+              [Input('emp_records', 'data'),
+               Input('emp_partial', 'data'),
+               Input('min_year_select', 'value')],
+              [State('employee_input_value', 'value')])
+def update_emp_summary_table(data, partial, year_select, employee):
+    df_wos, df_alex, unique_recs = load_emp_records(data, partial, year_select, employee)
     
     df_wos_n = 0
     if isinstance(df_wos, pd.DataFrame):
         if (len(df_wos)!=0):
             df_wos_n = len(df_wos)
     
-    if len(author_record['alex_id'])==0:
-        author_alex = None
-    elif len(author_record['alex_id'])>1:
-        author_alex = author_record['alex_id']
-        author_alex = author_alex.iloc[0]
-    else:
-        author_alex = author_record['alex_id'].item()
-    
-    if author_alex != None:
-        df_alex = create_record_tbl_alex(author_alex)
-        df_alex = df_alex[df_alex['work_publication_year']>=year_select]
-    else: 
-        df_alex = 0
-    
     df_alex_n = 0
     if isinstance(df_alex, pd.DataFrame):
         if (len(df_alex)!=0):
             df_alex_n = len(df_alex)
 
-    unique_recs = find_common_records(df_wos, df_alex)
-    if not isinstance(unique_recs, pd.DataFrame):
-        if unique_recs==0:
-            df = pd.DataFrame({'Records in WOS': [0], 'Records in OpenAlex': [0], 'Unique Records': [0]}) 
-    elif isinstance(unique_recs, pd.DataFrame) & (len(unique_recs)==0):
-        df = pd.DataFrame({'Records in WOS': [0], 'Records in OpenAlex': [0], 'Unique Records': [0]})
-    elif isinstance(unique_recs, pd.DataFrame):
+    if isinstance(unique_recs, pd.DataFrame):
         df = pd.DataFrame({'Records in WOS': [df_wos_n], 'Records in OpenAlex': [df_alex_n], 'Unique Records': [len(unique_recs)]})
     else:
         df = pd.DataFrame({'Records in WOS': [0], 'Records in OpenAlex': [0], 'Unique Records': [0]})
@@ -219,330 +463,179 @@ def update_emp_summary_table(value, year_select):
                                 row_selectable="multi",editable=False, 
                                 style_data={'whiteSpace': 'normal', 'height': 'auto'})
 
-@app.callback(Output('emp_summary', 'children'),
-              [Input('employee_input_value', 'value'),
-               Input('min_year_select', 'value')])
-def update_emp_info(value, year_select):
-    author_record = find_lookup_record(value)
-    author_wos = author_record['wos_id'].to_list()
-    if len(author_wos)==0:
-        df_wos = 0
-    elif None not in author_wos:
-        df_wos = create_record_tbl(author_wos, api_inst)
-        df_wos = df_wos[df_wos['publishYear']>=year_select]
-    else:
-        df_wos = 0
-    
-    if len(author_record['alex_id'])==0:
-        author_alex = None
-    elif len(author_record['alex_id'])>1:
-        author_alex = author_record['alex_id']
-        author_alex = author_alex.iloc[0]
-    else:
-        author_alex = author_record['alex_id'].item()
-    
-    if author_alex != None:
-        df_alex = create_record_tbl_alex(author_alex)
-        df_alex = df_alex[df_alex['work_publication_year']>=year_select]
-    else: 
-        df_alex = 0
-    
-    unique_recs = find_common_records(df_wos, df_alex)
-    if not isinstance(unique_recs, pd.DataFrame):
-        if unique_recs==0:
-            df_common = pd.DataFrame({'Records in WOS': [0], 'Records in OpenAlex': [0], 'Unique Records': [0]}) 
-    elif isinstance(unique_recs, pd.DataFrame) & (len(unique_recs)==0):
-        df_common = pd.DataFrame({'Records in WOS': [0], 'Records in OpenAlex': [0], 'Unique Records': [0]})
-    elif isinstance(unique_recs, pd.DataFrame):
-        df_common = df_wos.iloc[0].copy()
-        df_common['web_source'] = 'WOS'
-        df_common = df_common.to_frame().transpose()
-        
-        for work in range(len(unique_recs)):
-            work_n = unique_recs.iloc[work]
-            if work_n['title'] in df_wos['title'].str.lower().to_list():
-                df_common_add = df_wos[(df_wos['title'].str.lower()==work_n['title']) & (df_wos['publishYear']==work_n['publishYear'])].copy() 
-                df_common_add['web_source'] = 'WOS'
-                df_common = pd.concat([df_common, df_common_add], axis=0, ignore_index=True)
-            elif work_n['title'] in df_alex['work_title'].str.lower().to_list():
-                df_common_add_alex = df_alex[(df_alex['work_title'].str.lower()==work_n['title']) & (df_alex['work_publication_year']==work_n['publishYear'])].copy()
-                df_common_add = pd.DataFrame({'work_id':df_common_add_alex['work_id'], 'title':df_common_add_alex['work_title'], 'source':df_common_add_alex['work_source'], 'publishYear':df_common_add_alex['work_publication_year'], 'web_source':'OpenAlex'})
-                df_common = pd.concat([df_common, df_common_add], axis=0, ignore_index=True)
-        
-        df_common = df_common.drop(df_common.index[0]).reset_index(drop=True)
+@app.callback([Output('common_table', 'data'), Output('common_table', 'columns'), Output('common_table', 'page_count'),
+               Output('common_table', 'page_current')],
+              [Input('emp_records', 'data'),
+               Input('emp_partial', 'data'),
+               Input('min_year_select', 'value'),
+               Input('common_table', 'page_current'),
+               Input('common_table', 'page_size'),
+               Input('common_table', 'sort_by'),
+               Input('common_table', 'filter_query')],
+              [State('employee_input_value', 'value')])
+def update_emp_info(data, partial, year_select, page_current, page_size, sort_by, filter_query, employee):
+    _, _, unique_recs = load_emp_records(data, partial, year_select, employee)
+    if isinstance(unique_recs, pd.DataFrame) and (len(unique_recs)!=0):
+        df_common = unique_recs
     else:
         df_common = pd.DataFrame({'Records in WOS': [0], 'Records in OpenAlex': [0], 'Unique Records': [0]})
-    
-    return dash_table.DataTable(df_common.to_dict('records'), [{"name": i, "id": i} for i in df_common.columns], 
-                                row_selectable="multi",editable=False, 
-                                style_data={'whiteSpace': 'normal', 'height': 'auto'})
-
-
-@app.callback(Output('emp_table_tab1', 'children'),
-              [Input('employee_input_value', 'value'),
-               Input('min_year_select', 'value')])
-def update_emp_wos(value, year_select):
-    author_wos = find_lookup_record(value)
-    author_wos = author_wos['wos_id'].to_list()
-    if len(author_wos)==0:
+    return page_table(df_common, page_current, page_size, sort_by, filter_query)
+
+
+@app.callback([Output('wos_table', 'data'), Output('wos_table', 'columns'), Output('wos_table', 'page_count'),
+               Output('wos_table', 'page_current')],
+              [Input('emp_records', 'data'),
+               Input('emp_partial', 'data'),
+               Input('min_year_select', 'value'),
+               Input('wos_table', 'page_current'),
+               Input('wos_table', 'page_size'),
+               Input('wos_table', 'sort_by'),
+               Input('wos_table', 'filter_query')],
+              [State('employee_input_value', 'value')])
+def update_emp_wos(data, partial, year_select, page_current, page_size, sort_by, filter_query, employee):
+    df, _, _ = load_emp_records(data, partial, year_select, employee)
+    if not isinstance(df, pd.DataFrame):
         df = pd.DataFrame({'Number of records':[0]})
-    elif None not in author_wos:
-        df = create_record_tbl(author_wos, api_inst)
-        df = df[df['publishYear']>=year_select]
-    else:
+    return page_table(df, page_current, page_size, sort_by, filter_query)
+
+
+@app.callback([Output('alex_table', 'data'), Output('alex_table', 'columns'), Output('alex_table', 'page_count'),
+               Output('alex_table', 'page_current')],
+              [Input('emp_records', 'data'),
+               Input('emp_partial', 'data'),
+               Input('min_year_select', 'value'),
+               Input('alex_table', 'page_current'),
+               Input('alex_table', 'page_size'),
+               Input('alex_table', 'sort_by'),
+               Input('alex_table', 'filter_query')],
+              [State('employee_input_value', 'value')])
+def update_emp_alex(data, partial, year_select, page_current, page_size, sort_by, filter_query, employee):
+    _, df, _ = load_emp_records(data, partial, year_select, employee)
+    if not isinstance(df, pd.DataFrame):
         df = pd.DataFrame({'Number of records':[0]})
-    
-    return dash_table.DataTable(df.to_dict('records'), [{"name": i, "id": i} for i in df.columns], 
-                                row_selectable="multi",editable=False, 
-                                style_data={'whiteSpace': 'normal', 'height': 'auto'})
+    return page_table(df, page_current, page_size, sort_by, filter_query)
 
 
-@app.callback(Output('emp_table_tab2', 'children'),
-              [Input('employee_input_value', 'value'),
-               Input('min_year_select', 'value')])
-def update_emp_alex(value, year_select):
-    author_alex = find_lookup_record(value)
-    if len(author_alex['alex_id'])==0:
-        author_alex = None
-    elif len(author_alex['alex_id'])>1:
-        author_alex = author_alex['alex_id']
-        author_alex = author_alex.iloc[0]
-    else:
-        author_alex = author_alex['alex_id'].item()
+@app.callback([Output('group_value', 'options'), Output('group_value', 'value')],
+              [Input('group_level', 'value')])
+def update_group_options(level):
+    options = sorted(emp[level].dropna().unique().tolist())
+    return options, (options[0] if len(options)!=0 else None)
 
-    
-    if author_alex != None:
-        df = create_record_tbl_alex(author_alex)
-        df = df[df['work_publication_year']>=year_select]
-    else: 
-        df = pd.DataFrame({'Number of records':[0]})
-    
-    return dash_table.DataTable(df.to_dict('records'), [{"name": i, "id": i} for i in df.columns], 
-                                row_selectable="multi",editable=False,
-                                style_data={'whiteSpace': 'normal', 'height': 'auto'})
-
-
-# @app.callback(Output('worker_table_active', 'data'),
-#               [Input('employee_input_value', 'value')])
-# def update_emp_table(value):
-#     author_wos = find_lookup_record(value)
-#     df = create_record_tbl(author_wos, api_inst)
-#     return df.to_json(date_format='iso', orient='split')
-
-
-# @app.callback(Output("worker_table_tab1", 'children'),
-#               Input('worker_table_active', 'data'))
-# def show_emp_table_tabl(df):
-#     df = pd.read_json(df, orient='split')
-#     return dash_table.DataTable(df.to_dict('records'), [{"name": i, "id": i} for i in df.columns], 
-#                                 row_selectable="multi",editable=False)
-
-
-def create_record_tbl_alex(author_id_in):
-    ### WOS records
-    ### Check if there is no matching WOS id first
-    usd_alex_id = "https://openalex.org/I160856358"
-    pub_alex = get_open_alex_data_ai(author_id_in)
-    pub_alex = pub_alex.loc[pub_alex['institution_id'] == usd_alex_id]
-    pub_alex = pub_alex[['work_id', 'work_title', 'work_publication_year', 'work_source']]
-    return pub_alex
-
-def create_record_tbl(author_id_in, api_param_in):
-    ### WOS records
-    ### Check if there is no matching WOS id first
-    pub_df=[]
-    for author_n in range(len(author_id_in)):
-        author_wos_id = author_id_in[author_n]
-        rec1_df = get_wos_data_ai(api_param_in, 1, author_wos_id).to_dict()
-        n_records = rec1_df['metadata']['total']
-        ### if there is more than 1 record:
-        if n_records > 1:
-            n_limit = rec1_df['metadata']['limit']
-            page = range(1, n_records//n_limit+2)
-            data = []
-            for page_n in page:
-                rec1_df = get_wos_data_ai(api_param_in, page_n, author_wos_id).to_dict() 
-                for index in range(len(rec1_df['hits'])):
-                    if 'doi' in rec1_df['hits'][index]['identifiers']:
-                        doi = rec1_df['hits'][index]['identifiers']['doi']
-                    else:
-                        doi = None
-                    if 'issn' in rec1_df['hits'][index]['identifiers']:
-                        issn = rec1_df['hits'][index]['identifiers']['issn']
-                    else:
-                        issn = None
-                    if 'eissn' in rec1_df['hits'][index]['identifiers']:
-                        eissn = rec1_df['hits'][index]['identifiers']['eissn']
-                    else:
-                        eissn = None
-                    pub_df.append({
-                        'work_id': rec1_df['hits'][index]['uid'].split(':')[1],
-                        'title': rec1_df['hits'][index]['title'],
-                        'source': rec1_df['hits'][index]['source']['sourceTitle'],
-                        'publishYear': rec1_df['hits'][index]['source']['publishYear'],
-                        'doi': doi,
-                        'issn': issn,
-                        'eissn': eissn,
-                        })
-    pub_df = pd.DataFrame(pub_df)
-    return pub_df
-
-def get_wos_data_au(api_instance, page_n, author):
-    q = f'AU={author} AND OG=University of San Diego AND PY=(2000-{current_year})' # str | Web of Science advanced [advanced search query builder](https://webofscience.help.clarivate.com/en-us/Content/advanced-search.html). The supported field tags are listed in description.
-    db = 'WOS' # str | Web of Science Database abbreviation * WOS - Web of Science Core collection * BIOABS - Biological Abstracts * BCI - BIOSIS Citation Index * BIOSIS - BIOSIS Previews * CCC - Current Contents Connect * DIIDW - Derwent Innovations Index * DRCI - Data Citation Index * MEDLINE - MEDLINE The U.S. National Library of Medicine® (NLM®) premier life sciences database. * ZOOREC - Zoological Records * PPRN - Preprint Citation Index * WOK - All databases  (optional) (default to 'WOS')
-    limit = 50 # int | set the limit of records on the page (1-50) (optional) (default to 10)
-    page = page_n # int | set the result page (optional) (default to 1)
-    sort_field = 'LD+D' # str | Order by field(s). Field name and order by clause separated by '+', use A for ASC and D for DESC, ex: PY+D. Multiple values are separated by comma. Supported fields:  * **LD** - Load Date * **PY** - Publication Year * **RS** - Relevance * **TC** - Times Cited  (optional)
-    modified_time_span = None # str | Defines a date range in which the results were most recently modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
-    tc_modified_time_span = None # str | Defines a date range in which times cited counts were modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
-    detail = None # str | it will returns the full data by default, if detail=short it returns the limited data (optional)
-
-    try:
-        # Query Web of Science documents 
-        api_response = api_instance.documents_get(q, db=db, limit=limit, page=page, sort_field=sort_field, modified_time_span=modified_time_span, tc_modified_time_span=tc_modified_time_span, detail=detail)
-        return api_response
-        # print("The response of DocumentsApi->documents_get:\n")
-        # pprint(api_response)
-    except ApiException as e:
-        return print("Exception when calling DocumentsApi->documents_get: %s\n" % e)
-    
-def get_wos_data_ai(api_instance, page_n, author_id):
-    q = f'AI={author_id}' # str | Web of Science advanced [advanced search query builder](https://webofscience.help.clarivate.com/en-us/Content/advanced-search.html). The supported field tags are listed in description.
-    db = 'WOS' # str | Web of Science Database abbreviation * WOS - Web of Science Core collection * BIOABS - Biological Abstracts * BCI - BIOSIS Citation Index * BIOSIS - BIOSIS Previews * CCC - Current Contents Connect * DIIDW - Derwent Innovations Index * DRCI - Data Citation Index * MEDLINE - MEDLINE The U.S. National Library of Medicine® (NLM®) premier life sciences database. * ZOOREC - Zoological Records * PPRN - Preprint Citation Index * WOK - All databases  (optional) (default to 'WOS')
-    limit = 50 # int | set the limit of records on the page (1-50) (optional) (default to 10)
-    page = page_n # int | set the result page (optional) (default to 1)
-    sort_field = 'LD+D' # str | Order by field(s). Field name and order by clause separated by '+', use A for ASC and D for DESC, ex: PY+D. Multiple values are separated by comma. Supported fields:  * **LD** - Load Date * **PY** - Publication Year * **RS** - Relevance * **TC** - Times Cited  (optional)
-    modified_time_span = None # str | Defines a date range in which the results were most recently modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
-    tc_modified_time_span = None # str | Defines a date range in which times cited counts were modified. Beginning and end dates must be specified in the yyyy-mm-dd format separated by '+' or ' ', e.g. 2023-01-01+2023-12-31. This parameter is not compatible with the all databases search, i.e. db=WOK is not compatible with this parameter. (optional)
-    detail = None # str | it will returns the full data by default, if detail=short it returns the limited data (optional)
-
-    try:
-        # Query Web of Science documents 
-        api_response = api_instance.documents_get(q, db=db, limit=limit, page=page, sort_field=sort_field, modified_time_span=modified_time_span, tc_modified_time_span=tc_modified_time_span, detail=detail)
-        return api_response
-        # print("The response of DocumentsApi->documents_get:\n")
-        # pprint(api_response)
-    except ApiException as e:
-        return print("Exception when calling DocumentsApi->documents_get: %s\n" % e)
-
-def get_open_alex_data_ai(id_in):
-    endpoint = 'authors'
-    filtered_works_url = f'https://api.openalex.org/works?filter=author.id:{id_in}'
-    page_with_results = requests.get(filtered_works_url).json()
-    # page_with_results['meta']
-    # works = page_with_results['results']
-
-    cursor_alex = '*'
-
-    select = ",".join((
-        'id',
-        'ids',
-        'title',
-        'display_name',
-        'publication_year',
-        'publication_date',
-        'primary_location',
-        'open_access',
-        'authorships',
-        'cited_by_count',
-        'is_retracted',
-        'is_paratext',
-        'updated_date',
-        'created_date',
-    ))
-
-    # loop through pages
-    works = []
-    loop_index = 0
-    while cursor_alex:
-        # set cursor value and request page from OpenAlex
-        url = f'{filtered_works_url}&select={select}&cursor={cursor_alex}'
-        page_with_results = requests.get(url).json()
-        
-        results = page_with_results['results']
-        works.extend(results)
-
-        # update cursor to meta.next_cursor
-        cursor_alex = page_with_results['meta']['next_cursor']
-        loop_index += 1
-        if loop_index in [5, 10, 20, 50, 100] or loop_index % 500 == 0:
-            print(f'{loop_index} api requests made so far')
-    print(f'done. made {loop_index} api requests. collected {len(works)} works')
-
-    data = []
-    for work in works:
-        if work['primary_location'] != None:
-            if work['primary_location']["source"] != None:
-                source_display_name = work['primary_location']['source']['display_name']
-        else:
-            source_display_name = None
-        for authorship in work['authorships']:
-            if authorship:
-                author = authorship['author']
-                author_id = author['id'] if author else None
-                author_name = author['display_name'] if author else None
-                author_position = authorship['author_position']
-                for institution in authorship['institutions']:
-                    if institution:
-                        institution_id = institution['id']
-                        institution_name = institution['display_name']
-                        institution_country_code = institution['country_code']
-                        data.append({
-                            'work_id': work['id'],
-                            'work_title': work['title'],
-                            'work_display_name': work['display_name'],
-                            'work_publication_year': work['publication_year'],
-                            'work_publication_date': work['publication_date'],
-                            'work_source': source_display_name,
-                            'author_id': author_id,
-                            'author_name': author_name,
-                            'author_position': author_position,
-                            'institution_id': institution_id,
-                            'institution_name': institution_name,
-                            'institution_country_code': institution_country_code,
-                        })
-    pub_alex = pd.DataFrame(data)
-    pub_alex = pub_alex[pub_alex['author_id'] == 'https://openalex.org/'+id_in]
-    return pub_alex
-
-
-
-def find_lookup_record(author_in):
-    author_record = emp[emp['preferred_name']==author_in]
-    author_record = id_lookup[id_lookup['emp_id']==int(author_record['emp_id'].values[0])]
-    # author_record = author_record['wos_id'].to_list()
-    return author_record
 
+@app.callback([Output('group_info', 'children'), Output('group_by_year', 'children'), Output('group_breakdown', 'children')],
+              [Input('group_level', 'value'),
+               Input('group_value', 'value'),
+               Input('min_year_select', 'value')])
+def update_group_summary(level, value, year_select):
+    ### Roll-up of the precomputed per-person, per-year counts; no API calls
+    if value is None:
+        return html.P("Select a department or college."), None, None
+    if year_select is None:
+        year_select = first_year
+    breakdown = 'preferred_name' if level=='department' else 'department'
+    by_year, by_group, n_covered, n_people = rollup(emp, level, value, year_select, breakdown)
+    labels = {'year': 'Year', 'preferred_name': 'Employee', 'department': 'Department', 'wos': 'Records in WOS',
+              'alex': 'Records in OpenAlex', 'overlap': 'In both', 'unique_records': 'Unique Records'}
+    info = html.P(f"{n_covered} of {n_people} employees in {value} have records harvested back to {year_select}.")
+    tables = [dash_table.DataTable(df.to_dict('records'), [{"name": labels[i], "id": i} for i in df.columns],
+                                   page_size=PAGE_SIZE, sort_action='native', editable=False,
+                                   style_data={'whiteSpace': 'normal', 'height': 'auto'})
+              for df in (by_year, by_group)]
+    return info, tables[0], tables[1]
+
+
+### column layout of the unique records (WOS layout plus web_source and match_confidence)
+unique_dtypes = {'work_id': object, 'title': object, 'source': object, 'publishYear': 'int32', 'doi': object,
+                 'issn': object, 'eissn': object, 'web_source': object, 'match_confidence': 'float64'}
 
 def find_common_records(df1_wos, df2_alex):
-    if isinstance(df1_wos, pd.DataFrame):
-        df_wos_sub = df1_wos[['title','source','publishYear']].copy()
-        df_wos_sub['title'] = df_wos_sub['title'].str.lower()
-        df_wos_sub['source'] = df_wos_sub['source'].str.lower()    
-    else:
-        df_wos_sub = 0
-    
-    if isinstance(df2_alex, pd.DataFrame):
-        df_alex_sub = df2_alex[['work_title','work_source','work_publication_year']].copy()
-        df_alex_sub['work_source'] = df_alex_sub['work_source'].str.lower()
-        df_alex_sub['work_title'] = df_alex_sub['work_title'].str.lower()
-        df_alex_sub.columns = ['title','source','publishYear']
-    else:
-        df_alex_sub = 0
-
-    if (isinstance(df_wos_sub, pd.DataFrame)) and (isinstance(df_alex_sub, pd.DataFrame)):
-        df_combined = pd.concat([df_wos_sub, df_alex_sub], axis=0)
-        df_combined = df_combined.drop_duplicates(subset=['title','publishYear'], keep=False)
-    elif isinstance(df_wos_sub, pd.DataFrame) and (df_alex_sub == 0):
-        df_combined = df_wos_sub
-    elif (df_wos_sub == 0) and (isinstance(df_alex_sub, pd.DataFrame)):
-        df_combined = df_alex_sub
-    else:
-        df_combined = 0
+    ### Records found in only one of the two sources, in the WOS column layout
+    ### with web_source and match_confidence (best similarity to a record of
+    ### the other source) columns; 0 when neither source is available
+    if (not isinstance(df1_wos, pd.DataFrame)) and (not isinstance(df2_alex, pd.DataFrame)):
+        return 0
+    if not isinstance(df1_wos, pd.DataFrame):
+        df1_wos = pd.DataFrame(columns=wos_columns)
+    if not isinstance(df2_alex, pd.DataFrame):
+        df2_alex = pd.DataFrame(columns=alex_columns)
+
+    pairs, wos_only, alex_only = match_records(df1_wos, df2_alex)
+    wos_only = wos_only.assign(web_source='WOS')
+    alex_only = pd.DataFrame({'work_id': alex_only['work_id'],
+                              'title': alex_only['work_title'],
+                              'source': alex_only['work_source'],
+                              'publishYear': alex_only['work_publication_year'],
+                              'doi': alex_only['work_doi'] if 'work_doi' in alex_only.columns else None,
+                              'web_source': 'OpenAlex',
+                              'match_confidence': alex_only['match_confidence']})
+    ### both halves in the same columns and dtypes, so concat never has to
+    ### infer a dtype from an empty or all-NA column
+    frames = [df.reindex(columns=list(unique_dtypes)).astype(unique_dtypes) for df in (wos_only, alex_only)]
+    df_combined = pd.concat(frames, axis=0, ignore_index=True)
     return df_combined
 
 
 server = app.server
+install(server)
+
+
+#####################################
+# Bulk export
+#####################################
+# /export?scope=person|department|college|roster&value=...&records=merged|wos|alex&format=csv|parquet&min_year=...
+# Reads the local publication store only; people who have not been harvested
+# are left out rather than fetched inside the request.
+
+def export_people(scope, value):
+    if scope == 'roster':
+        return list(emp_by_id)
+    if scope == 'person':
+        return [emp_by_name[value]] if value in emp_by_name else []
+    if scope in ('department', 'college'):
+        return [emp_id for emp_id, record in emp_by_id.items() if record[scope] == value]
+    return []
+
+
+def export_frame(emp_id, records, min_year):
+    record = emp_by_id[emp_id]
+    df_wos, df_alex = read_emp_records(record)
+    if isinstance(df_wos, pd.DataFrame):
+        df_wos = df_wos[df_wos['publishYear']>=min_year]
+    if isinstance(df_alex, pd.DataFrame):
+        df_alex = df_alex[df_alex['work_publication_year']>=min_year]
+    if records == 'wos':
+        df = df_wos
+    elif records == 'alex':
+        df = df_alex
+    else:
+        df = find_common_records(df_wos, df_alex)
+    if not isinstance(df, pd.DataFrame):
+        return None
+    return df.assign(emp_id=emp_id, preferred_name=record['preferred_name'], department=record['department'])
+
+
+@server.route('/export')
+def export_records():
+    args = flask.request.args
+    scope = args.get('scope', 'person')
+    value = args.get('value')
+    records = args.get('records', 'merged')
+    fmt = args.get('format', 'csv')
+    if (records not in export_schemas) or (fmt not in export_formats):
+        return flask.Response('records must be merged, wos or alex and format csv or parquet', status=400)
+    try:
+        min_year = int(args.get('min_year', first_year))
+    except ValueError:
+        return flask.Response('min_year must be a year', status=400)
+    people = export_people(scope, value)
+    if len(people) == 0:
+        return flask.Response(f'no employees for scope={scope} value={value}', status=404)
+    frames = (export_frame(emp_id, records, min_year) for emp_id in people)
+    name = 'roster' if scope == 'roster' else ''.join(c if c.isalnum() else '_' for c in value)
+    return flask.Response(flask.stream_with_context(stream_records(frames, records, fmt)),
+                          mimetype=export_formats[fmt],
+                          headers={'Content-Disposition': f'attachment; filename={name}_{records}.{fmt}'})
 
 if __name__ == '__main__':
     app.run(debug=True)
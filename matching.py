@@ -0,0 +1,259 @@
+import os
+import sys
+import html
+import unicodedata
+import numpy as np
+import pandas as pd
+
+
+#####################################
+# WOS / OpenAlex record matching
+#####################################
+# Records are matched on DOI first, then on a hash of the normalized title and
+# publication year. Keys are computed once per table and both joins are hash
+# merges, so matching is linear in the number of records. Records built by
+# records.WorkBuffer carry their keys (doi_key, title_key) from ingest.
+#
+# What is left is matched approximately, for titles that differ in
+# punctuation, HTML entities, subtitles or truncation. Each title gets a
+# MinHash signature of its character 3-grams. Candidate pairs come from a
+# blocking index, never from all pairs: the publication year within one year,
+# plus either a shared LSH bucket (a band of the signature) or the same
+# normalized venue name. Candidates are scored on their signatures at once:
+# estimated Jaccard similarity, or containment when, within the same venue,
+# the shorter title is the longer one without its subtitle or cut off (a
+# long prefix of it), so those still score high. Pairs scoring
+# MATCH_THRESHOLD or more are matched one to one, best score first.
+
+MATCH_THRESHOLD = float(os.environ.get('MATCH_THRESHOLD', 0.8))   # fuzzy title similarity needed for a match
+
+doi_prefix = r'^(https?://(dx\.)?doi\.org/|doi:\s*)'
+### combining marks (accents once decomposed); only these are dropped, so
+### titles in other scripts keep their letters
+combining_marks = dict.fromkeys(cp for cp in range(sys.maxunicode+1) if unicodedata.category(chr(cp)) == 'Mn')
+minhash_bands = 16
+minhash_rows = 2        # signature values per band
+min_shingles = 12       # shorter titles are only matched exactly
+year_window = 1
+truncation_ratio = 0.8  # share of the longer title a truncated title keeps
+subtitle_separator = r'\s*[:?!]\s+|\s+[-\u2013\u2014]+\s+|\.\s+'
+
+### fixed seeds, so signatures are comparable between calls and processes
+_hash_seeds = np.random.default_rng(20240611).integers(0, 2**63, size=(2, minhash_bands*minhash_rows), dtype=np.uint64)
+_hash_seeds[1] |= np.uint64(1)
+
+
+def normalize_titles(titles):
+    ### lowercase, accents removed, punctuation and whitespace collapsed
+    titles = titles.fillna('').astype(str)
+    titles = titles.str.normalize('NFKD').str.translate(combining_marks)
+    titles = titles.str.lower().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    return titles
+
+
+def normalize_dois(dois):
+    dois = dois.astype('string').str.strip().str.lower().str.replace(doi_prefix, '', regex=True)
+    return dois.mask(dois == '')
+
+
+def title_year_keys(title_keys, years):
+    ### one uint64 per record; empty titles never match
+    keys = pd.util.hash_pandas_object(pd.DataFrame({'title': title_keys.to_numpy(),
+                                                    'year': pd.to_numeric(years, errors='coerce').fillna(0).to_numpy().astype('int64')}),
+                                      index=False).to_numpy()
+    return pd.Series(keys, index=title_keys.index, dtype='UInt64').mask((title_keys == '').to_numpy())
+
+
+def doi_keys(dois):
+    ### uint64 hash of the normalized DOI; records without a DOI never match
+    keys = pd.util.hash_pandas_object(dois.fillna(''), index=False).to_numpy()
+    return pd.Series(keys, index=dois.index, dtype='UInt64').mask(dois.isna().to_numpy())
+
+
+def add_match_keys(df, title_col, year_col, doi_col):
+    ### df with hashed match keys: normalized DOI (doi_key) and normalized
+    ### title + year (title_key)
+    if doi_col in df.columns:
+        dois = normalize_dois(df[doi_col])
+    else:
+        dois = pd.Series(pd.NA, index=df.index, dtype='string')
+    return df.assign(doi_key=doi_keys(dois), title_key=title_year_keys(normalize_titles(df[title_col]), df[year_col]))
+
+
+def match_keys(df, title_col, year_col, doi_col):
+    if 'title_key' not in df.columns:
+        df = add_match_keys(df, title_col, year_col, doi_col)
+    return pd.DataFrame({'row': np.arange(len(df)),
+                         'doi': df['doi_key'].array,
+                         'key': df['title_key'].array})
+
+
+def _join(left, right, on):
+    left = left.dropna(subset=[on]).drop_duplicates(subset=[on])
+    right = right.dropna(subset=[on]).drop_duplicates(subset=[on])
+    return left[['row', on]].merge(right[['row', on]], on=on, suffixes=('_wos', '_alex'))[['row_wos', 'row_alex']]
+
+
+def fuzzy_titles(titles):
+    ### normalize_titles without HTML markup and entities
+    titles = titles.fillna('').astype(str).str.replace(r'<[^>]+>', ' ', regex=True).map(html.unescape)
+    return normalize_titles(titles)
+
+
+def main_titles(titles):
+    ### the title before its first subtitle separator, as fuzzy_titles
+    return fuzzy_titles(titles.fillna('').astype(str).str.split(subtitle_separator, n=1, regex=True).str[0])
+
+
+def shortened(title_w, main_w, title_a, main_a):
+    ### is the shorter title the longer one with its subtitle dropped, or the
+    ### longer one cut off? Only then is it scored by containment; a short
+    ### title found somewhere inside a longer one is a different paper
+    if len(title_w) > len(title_a):
+        title_w, main_w, title_a, main_a = title_a, main_a, title_w, main_w
+    return (title_w == main_a) or (title_a.startswith(title_w) and (len(title_w) >= truncation_ratio*len(title_a)))
+
+
+def title_numbers(titles):
+    ### the numbers of each title (volume, part, year, ...); titles that both
+    ### have numbers only match when these agree, so "Part 1" is not "Part 2"
+    return titles.str.findall(r'\b\d+\b').str.join(' ').to_numpy()
+
+
+def minhash_signatures(titles):
+    ### (signatures, sizes): one row of min-hashes of the character 3-grams
+    ### per title, and the number of distinct 3-grams of each title; spaces
+    ### are dropped so split or hyphenated words still share their 3-grams
+    titles = [title.replace(' ', '') for title in titles]
+    shingles = [{title[i:i+3] for i in range(len(title)-2)} for title in titles]
+    sizes = np.array([len(s) for s in shingles], dtype=np.int64)
+    signatures = np.full((len(shingles), _hash_seeds.shape[1]), np.iinfo(np.uint64).max, dtype=np.uint64)
+    present = np.flatnonzero(sizes > 0)
+    if len(present) == 0:
+        return signatures, sizes
+    hashes = pd.util.hash_array(np.array([s for record in shingles for s in record], dtype=object))
+    starts = np.concatenate([[0], np.cumsum(sizes[present])[:-1]])
+    for i, (seed, multiplier) in enumerate(_hash_seeds.T):
+        h = (hashes ^ seed) * multiplier
+        h ^= h >> np.uint64(29)
+        signatures[present, i] = np.minimum.reduceat(h, starts)
+    return signatures, sizes
+
+
+def _blocks(keys, rows, years, offsets):
+    ### blocking index entries: (keys..., year, row), repeated for every
+    ### year offset so a merge on the year finds neighbouring years
+    index = pd.DataFrame(dict(keys, row=rows, year=years))
+    return pd.concat([index.assign(year=index['year']+offset) for offset in offsets], axis=0, ignore_index=True)
+
+
+def fuzzy_candidates(df_wos, df_alex, rows_wos, rows_alex):
+    ### scored candidate pairs (row_wos, row_alex, score) among the given rows
+    ### of each table; rows are positions, as in match_keys
+    sides = []
+    for df, rows, title_col, year_col, source_col in ((df_wos, rows_wos, 'title', 'publishYear', 'source'),
+                                                     (df_alex, rows_alex, 'work_title', 'work_publication_year', 'work_source')):
+        titles = fuzzy_titles(df[title_col].iloc[rows])
+        keep = (titles.str.replace(' ', '', regex=False).str.len() >= min_shingles+2).to_numpy()
+        rows = rows[keep]
+        titles = titles[keep]
+        mains = main_titles(df[title_col].iloc[rows]).to_numpy()
+        signatures, sizes = minhash_signatures(titles.tolist())
+        numbers = title_numbers(titles)
+        years = pd.to_numeric(df[year_col].iloc[rows], errors='coerce').fillna(0).to_numpy().astype('int64')
+        if source_col in df.columns:
+            sources = normalize_titles(df[source_col].iloc[rows].astype(object)).to_numpy()
+        else:
+            sources = np.full(len(rows), '', dtype=object)
+        sides.append((rows, signatures, sizes, years, sources, numbers, titles.to_numpy(), mains))
+    (rows_w, sig_w, size_w, year_w, source_w, numbers_w, titles_w, mains_w), \
+        (rows_a, sig_a, size_a, year_a, source_a, numbers_a, titles_a, mains_a) = sides
+    empty = pd.DataFrame({'row_wos': pd.Series(dtype='int64'), 'row_alex': pd.Series(dtype='int64'),
+                          'score': pd.Series(dtype='float64')})
+    if (len(rows_w) == 0) or (len(rows_a) == 0):
+        return empty
+
+    ### LSH buckets: a band of minhash_rows signature values hashed to one key
+    def band_keys(signatures):
+        bands = pd.DataFrame(signatures.reshape(-1, minhash_rows))
+        return {'band': np.tile(np.arange(minhash_bands), len(signatures)),
+                'bucket': pd.util.hash_pandas_object(bands, index=False).to_numpy()}
+
+    pos_w = np.arange(len(rows_w))
+    pos_a = np.arange(len(rows_a))
+    offsets = range(-year_window, year_window+1)
+    lsh = _blocks(band_keys(sig_w), np.repeat(pos_w, minhash_bands), np.repeat(year_w, minhash_bands), [0]).merge(
+        _blocks(band_keys(sig_a), np.repeat(pos_a, minhash_bands), np.repeat(year_a, minhash_bands), offsets),
+        on=['band', 'bucket', 'year'], suffixes=('_wos', '_alex'))
+    has_w = source_w != ''
+    has_a = source_a != ''
+    venue = _blocks({'venue': source_w[has_w]}, pos_w[has_w], year_w[has_w], [0]).merge(
+        _blocks({'venue': source_a[has_a]}, pos_a[has_a], year_a[has_a], offsets),
+        on=['venue', 'year'], suffixes=('_wos', '_alex'))
+    pair_codes = np.unique(np.concatenate([lsh['row_wos'].to_numpy()*len(rows_a) + lsh['row_alex'].to_numpy(),
+                                           venue['row_wos'].to_numpy()*len(rows_a) + venue['row_alex'].to_numpy()]))
+    pw, pa = np.divmod(pair_codes, len(rows_a))
+    agree = (numbers_w[pw] == numbers_a[pa]) | (numbers_w[pw] == '') | (numbers_a[pa] == '')
+    pw = pw[agree]
+    pa = pa[agree]
+    if len(pw) == 0:
+        return empty
+
+    jaccard = (sig_w[pw] == sig_a[pa]).mean(axis=1)
+    shorter = np.minimum(size_w[pw], size_a[pa])
+    containment = np.minimum(1.0, jaccard*(size_w[pw]+size_a[pa])/((1+jaccard)*shorter))
+    ### containment only within the same venue, and only for a dropped
+    ### subtitle or a truncation
+    same_venue = np.flatnonzero((source_w[pw] == source_a[pa]) & has_w[pw])
+    partial = np.zeros(len(pw), dtype=bool)
+    partial[same_venue] = [shortened(titles_w[w], mains_w[w], titles_a[a], mains_a[a])
+                           for w, a in zip(pw[same_venue], pa[same_venue])]
+    return pd.DataFrame({'row_wos': rows_w[pw], 'row_alex': rows_a[pa],
+                         'score': np.where(partial, np.maximum(jaccard, containment), jaccard).round(3)})
+
+
+def best_pairs(candidates):
+    ### one to one, best score first
+    candidates = candidates.sort_values('score', ascending=False, kind='stable')
+    return candidates.drop_duplicates(subset=['row_wos']).drop_duplicates(subset=['row_alex']).reset_index(drop=True)
+
+
+def match_records(df_wos, df_alex):
+    ### Returns (pairs, wos_only, alex_only): pairs holds the matched row
+    ### positions (row_wos, row_alex), a match column ('doi', 'title' or
+    ### 'fuzzy') and its confidence (1 for exact matches); wos_only /
+    ### alex_only are the unmatched rows of each table, with a
+    ### match_confidence column holding the best similarity to a record of the
+    ### other source (0 when no record was a candidate).
+    keys_wos = match_keys(df_wos, 'title', 'publishYear', 'doi')
+    keys_alex = match_keys(df_alex, 'work_title', 'work_publication_year', 'work_doi')
+
+    pairs_doi = _join(keys_wos, keys_alex, 'doi')
+    pairs_doi['match'] = 'doi'
+    rest_wos = keys_wos[~keys_wos['row'].isin(pairs_doi['row_wos'])]
+    rest_alex = keys_alex[~keys_alex['row'].isin(pairs_doi['row_alex'])]
+    pairs_title = _join(rest_wos, rest_alex, 'key')
+    pairs_title['match'] = 'title'
+    rest_wos = rest_wos[~rest_wos['row'].isin(pairs_title['row_wos'])]
+    rest_alex = rest_alex[~rest_alex['row'].isin(pairs_title['row_alex'])]
+    candidates = fuzzy_candidates(df_wos, df_alex, rest_wos['row'].to_numpy(), rest_alex['row'].to_numpy())
+    pairs_fuzzy = best_pairs(candidates[candidates['score'] >= MATCH_THRESHOLD])
+    pairs_fuzzy = pairs_fuzzy.rename(columns={'score': 'confidence'}).assign(match='fuzzy')
+    pairs = pd.concat([pairs_doi.assign(confidence=1.0), pairs_title.assign(confidence=1.0),
+                       pairs_fuzzy[['row_wos', 'row_alex', 'match', 'confidence']]], axis=0, ignore_index=True)
+
+    ### a record that shares a key with a record of the other source is not unique,
+    ### including same-source duplicates of it
+    matched_wos = keys_wos['row'].isin(pairs['row_wos']) \
+        | keys_wos['doi'].isin(keys_wos['doi'].iloc[pairs['row_wos']].dropna()) \
+        | keys_wos['key'].isin(keys_wos['key'].iloc[pairs['row_wos']].dropna())
+    matched_alex = keys_alex['row'].isin(pairs['row_alex']) \
+        | keys_alex['doi'].isin(keys_alex['doi'].iloc[pairs['row_alex']].dropna()) \
+        | keys_alex['key'].isin(keys_alex['key'].iloc[pairs['row_alex']].dropna())
+    rows_wos = np.flatnonzero(~matched_wos.to_numpy())
+    rows_alex = np.flatnonzero(~matched_alex.to_numpy())
+    near_wos = candidates.groupby('row_wos')['score'].max()
+    near_alex = candidates.groupby('row_alex')['score'].max()
+    wos_only = df_wos.iloc[rows_wos].assign(match_confidence=near_wos.reindex(rows_wos, fill_value=0.0).to_numpy())
+    alex_only = df_alex.iloc[rows_alex].assign(match_confidence=near_alex.reindex(rows_alex, fill_value=0.0).to_numpy())
+    return pairs, wos_only, alex_only
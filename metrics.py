@@ -0,0 +1,185 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+import cProfile
+from contextlib import contextmanager
+
+import flask
+
+
+#####################################
+# Stage timings and counters
+#####################################
+# Spans and counters are accumulated in memory per process and added to a
+# shared SQLite table at most every METRICS_FLUSH_INTERVAL seconds, so the
+# numbers of every gunicorn worker and background job process end up in one
+# place. /metrics renders the table in the Prometheus text format.
+#
+# Per-request profiling is off unless PROFILE_DIR is set; a request is then
+# profiled when it carries an "X-Profile: 1" header or a "profile=1" cookie,
+# and its cProfile stats are written to PROFILE_DIR.
+
+METRICS_PATH = os.environ.get('METRICS_PATH', 'Data/metrics.sqlite')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))   # seconds
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
+histogram_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+metric_types = {
+    'dashboard_stage_seconds': ('histogram', 'Time spent per stage (lookup, remote_page, parse, match, serialize, ...)'),
+    'dashboard_remote_calls_total': ('counter', 'Requests sent to the WOS and OpenAlex APIs'),
+    'dashboard_remote_bytes_total': ('counter', 'Response bytes received from the remote APIs'),
+    'dashboard_remote_retries_total': ('counter', 'Remote requests retried after a 429/5xx or connection error'),
+    'dashboard_remote_errors_total': ('counter', 'Remote requests that failed after their retries'),
+    'dashboard_cache_hits_total': ('counter', 'Publication store reads served without a remote call'),
+    'dashboard_cache_misses_total': ('counter', 'Publication store reads that needed a full harvest'),
+    'dashboard_cache_refreshes_total': ('counter', 'Stale publication store entries refreshed with a delta harvest'),
+    'dashboard_cache_coalesced_total': ('counter', 'Publication store reads that waited for another worker\'s harvest'),
+}
+
+_pending = {}
+_pending_pid = os.getpid()
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+
+
+def _connect():
+    con = sqlite3.connect(METRICS_PATH, timeout=30)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS metrics (
+                       name TEXT NOT NULL,
+                       labels TEXT NOT NULL,
+                       value REAL NOT NULL,
+                       PRIMARY KEY (name, labels))''')
+    return con
+
+
+def format_labels(labels):
+    return ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+
+def _add(series, value):
+    ### caller holds _lock; a forked process starts from an empty buffer so
+    ### the parent's unflushed values are not counted twice
+    global _pending, _pending_pid
+    if _pending_pid != os.getpid():
+        _pending = {}
+        _pending_pid = os.getpid()
+    _pending[series] = _pending.get(series, 0) + value
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _add((name, format_labels(labels)), value)
+    maybe_flush()
+
+
+def observe(name, seconds, **labels):
+    with _lock:
+        ### every bucket gets a series, 0 where the value is above it, so
+        ### histogram_quantile sees the full bucket layout
+        for le in histogram_buckets:
+            _add((f'{name}_bucket', format_labels(dict(labels, le=le))), 1 if seconds <= le else 0)
+        _add((f'{name}_bucket', format_labels(dict(labels, le='+Inf'))), 1)
+        _add((f'{name}_sum', format_labels(labels)), seconds)
+        _add((f'{name}_count', format_labels(labels)), 1)
+    maybe_flush()
+
+
+@contextmanager
+def span(stage, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('dashboard_stage_seconds', time.perf_counter()-t0, stage=stage, **labels)
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    global _pending, _last_flush
+    with _lock:
+        if _pending_pid != os.getpid():
+            return
+        pending, _pending = _pending, {}
+        _last_flush = time.monotonic()
+    if len(pending) == 0:
+        return
+    con = _connect()
+    try:
+        with con:
+            con.executemany('''INSERT INTO metrics VALUES (?, ?, ?)
+                               ON CONFLICT(name, labels) DO UPDATE SET value=value+excluded.value''',
+                            [(name, labels, value) for (name, labels), value in pending.items()])
+    finally:
+        con.close()
+
+
+atexit.register(flush)
+
+
+def _series_key(row):
+    ### one histogram after the other: buckets in increasing le, then _sum and _count
+    name, labels, _ = row
+    parts = labels.split(',')
+    le = [float(part[4:-1]) for part in parts if part.startswith('le=')]
+    base = ','.join(part for part in parts if not part.startswith('le='))
+    return (base, not name.endswith('_bucket'), name.endswith('_count'), le[0] if le else float('inf'))
+
+
+def render_metrics():
+    flush()
+    con = _connect()
+    try:
+        rows = con.execute('SELECT name, labels, value FROM metrics').fetchall()
+    finally:
+        con.close()
+    lines = []
+    for metric, (kind, help_text) in metric_types.items():
+        if kind == 'histogram':
+            series = [row for row in rows if row[0] in (f'{metric}_bucket', f'{metric}_sum', f'{metric}_count')]
+            series.sort(key=_series_key)
+        else:
+            series = sorted(row for row in rows if row[0] == metric)
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, labels, value in series:
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def profiling_requested():
+    return (flask.request.headers.get('X-Profile') == '1') or (flask.request.cookies.get('profile') == '1')
+
+
+def start_profile():
+    if PROFILE_DIR and profiling_requested():
+        flask.g.profiler = cProfile.Profile()
+        flask.g.profiler.enable()
+
+
+def stop_profile(response):
+    profiler = flask.g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = flask.request.path.strip('/').replace('/', '_') or 'index'
+        path = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{name}.prof')
+        profiler.dump_stats(path)
+        response.headers['X-Profile-File'] = path
+    return response
+
+
+def install(server):
+    ### server: the Flask app behind Dash (app.server)
+    server.add_url_rule('/metrics', 'metrics',
+                        lambda: flask.Response(render_metrics(), mimetype='text/plain; version=0.0.4'))
+    server.before_request(start_profile)
+    server.after_request(stop_profile)
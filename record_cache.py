@@ -0,0 +1,247 @@
+import os
+import re
+import time
+import datetime
+import sqlite3
+import threading
+
+from data_store import read_store, write_store
+from metrics import inc
+from records import category_columns, concat_records, ensure_match_keys
+
+
+#####################################
+# Persistent publication store
+#####################################
+# Normalized work records are stored per (source, author id) as Arrow IPC
+# files under STORE_DIR, read memory-mapped and column-projected. A SQLite
+# index beside them tracks the year floor, fetch time and size of every file.
+# WAL mode plus a busy timeout lets every gunicorn worker read and write the
+# same index; each call opens its own connection so nothing is shared across
+# forked processes.
+#
+# Harvests are single-flight across processes: the fetcher of a (source,
+# author id) holds a lease row in inflight_fetches, and any other worker or
+# thread that needs the same entry waits for it and reads the stored result
+# instead of calling the API again.
+
+CACHE_PATH = os.environ.get('RECORD_CACHE_PATH', 'Data/record_cache.sqlite')
+STORE_DIR = os.environ.get('RECORD_STORE_DIR', 'Data/pub_store')
+CACHE_TTL = int(os.environ.get('RECORD_CACHE_TTL', 24*60*60))                 # seconds before an entry is refreshed
+CACHE_MAX_BYTES = int(os.environ.get('RECORD_CACHE_MAX_BYTES', 256*1024*1024)) # total store size before LRU eviction
+INFLIGHT_TTL = int(os.environ.get('RECORD_INFLIGHT_TTL', 600))                # seconds before an abandoned lease is taken over
+INFLIGHT_POLL = float(os.environ.get('RECORD_INFLIGHT_POLL', 0.2))           # seconds between checks while waiting
+
+
+def _connect():
+    con = sqlite3.connect(CACHE_PATH, timeout=30)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS author_files (
+                       source TEXT NOT NULL,
+                       author_id TEXT NOT NULL,
+                       min_year INTEGER NOT NULL,
+                       fetched_at REAL NOT NULL,
+                       accessed_at REAL NOT NULL,
+                       nbytes INTEGER NOT NULL,
+                       PRIMARY KEY (source, author_id))''')
+    con.execute('''CREATE TABLE IF NOT EXISTS inflight_fetches (
+                       source TEXT NOT NULL,
+                       author_id TEXT NOT NULL,
+                       pid INTEGER NOT NULL,
+                       owner TEXT NOT NULL,
+                       expires_at REAL NOT NULL,
+                       PRIMARY KEY (source, author_id))''')
+    return con
+
+
+def store_path(source, author_id):
+    return os.path.join(STORE_DIR, source, re.sub(r'[^A-Za-z0-9_.-]', '_', author_id) + '.arrow')
+
+
+def cache_get(source, author_id, columns=None):
+    con = _connect()
+    try:
+        row = con.execute('SELECT min_year, fetched_at FROM author_files WHERE source=? AND author_id=?',
+                          (source, author_id)).fetchone()
+        if row is None:
+            return None
+        try:
+            df = read_store(store_path(source, author_id), columns)
+        except FileNotFoundError:
+            ### evicted by another worker in the meantime
+            return None
+        if columns is None:
+            df = ensure_match_keys(df, source)
+        with con:
+            con.execute('UPDATE author_files SET accessed_at=? WHERE source=? AND author_id=?',
+                        (time.time(), source, author_id))
+        return df, row[0], row[1]
+    finally:
+        con.close()
+
+
+def cache_put(source, author_id, df, min_year, fetched_at=None):
+    if fetched_at is None:
+        fetched_at = time.time()
+    df = df.reset_index(drop=True)
+    for col in category_columns:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    path = store_path(source, author_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_store(df, path)
+    evicted = []
+    con = _connect()
+    try:
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            con.execute('INSERT OR REPLACE INTO author_files VALUES (?, ?, ?, ?, ?, ?)',
+                        (source, author_id, min_year, fetched_at, time.time(), os.path.getsize(path)))
+            ### evict least recently used entries until the store fits
+            total = con.execute('SELECT COALESCE(SUM(nbytes), 0) FROM author_files').fetchone()[0]
+            if total > CACHE_MAX_BYTES:
+                rows = con.execute('SELECT source, author_id, nbytes FROM author_files ORDER BY accessed_at').fetchall()
+                for row in rows:
+                    if total <= CACHE_MAX_BYTES:
+                        break
+                    if (row[0], row[1]) == (source, author_id):
+                        continue
+                    con.execute('DELETE FROM author_files WHERE source=? AND author_id=?', (row[0], row[1]))
+                    evicted.append(store_path(row[0], row[1]))
+                    total -= row[2]
+    finally:
+        con.close()
+    for path in evicted:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def entry_min_year(source, author_id):
+    ### year the stored entry reaches back to, None when it is not stored
+    con = _connect()
+    try:
+        row = con.execute('SELECT min_year FROM author_files WHERE source=? AND author_id=?',
+                          (source, author_id)).fetchone()
+        return row[0] if row is not None else None
+    finally:
+        con.close()
+
+
+def list_entries():
+    ### (source, author_id, min_year, fetched_at) of every stored entry
+    con = _connect()
+    try:
+        return con.execute('SELECT source, author_id, min_year, fetched_at FROM author_files').fetchall()
+    finally:
+        con.close()
+
+
+def merge_records(df_old, df_new, key='work_id'):
+    ### upsert: records fetched in the delta replace their cached copies
+    if len(df_new)==0:
+        return df_old
+    return concat_records([df_old, df_new], key)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def acquire_fetch(source, author_id):
+    ### True when this thread now holds the lease; a lease whose holder has
+    ### exited (e.g. a terminated background job) or expired is taken over
+    owner = f'{os.getpid()}:{threading.get_ident()}'
+    con = _connect()
+    try:
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            row = con.execute('SELECT pid, owner, expires_at FROM inflight_fetches WHERE source=? AND author_id=?',
+                              (source, author_id)).fetchone()
+            if (row is not None) and (row[1] != owner) and (row[2] > time.time()) and pid_alive(row[0]):
+                return False
+            con.execute('INSERT OR REPLACE INTO inflight_fetches VALUES (?, ?, ?, ?, ?)',
+                        (source, author_id, os.getpid(), owner, time.time()+INFLIGHT_TTL))
+            return True
+    finally:
+        con.close()
+
+
+def release_fetch(source, author_id):
+    con = _connect()
+    try:
+        with con:
+            con.execute('DELETE FROM inflight_fetches WHERE source=? AND author_id=? AND owner=?',
+                        (source, author_id, f'{os.getpid()}:{threading.get_ident()}'))
+    finally:
+        con.close()
+
+
+def fetch_in_flight(source, author_id):
+    con = _connect()
+    try:
+        row = con.execute('SELECT pid, expires_at FROM inflight_fetches WHERE source=? AND author_id=?',
+                          (source, author_id)).fetchone()
+    finally:
+        con.close()
+    return (row is not None) and (row[1] > time.time()) and pid_alive(row[0])
+
+
+def usable_hit(hit, min_year, max_age, requested_at):
+    ### an entry reaching back to min_year that is fresh, or was stored after
+    ### the request started (by the fetch this request waited for)
+    return (hit is not None) and (hit[1] <= min_year) \
+        and ((time.time() - hit[2] < max_age) or (hit[2] >= requested_at))
+
+
+def get_cached_records(source, author_id, fetch_fn, min_year, max_age=None, full=False):
+    ### fetch_fn(author_id, since, min_year) returns the author's records published
+    ### in min_year or later; since is None for a full harvest, or the date of the
+    ### last fetch for a delta refresh. An entry harvested from an earlier year
+    ### also serves later years. max_age overrides CACHE_TTL (0 always refreshes).
+    ### full replaces the entry with a new full harvest instead of a delta.
+    if max_age is None:
+        max_age = CACHE_TTL
+    if full:
+        max_age = 0
+    requested_at = time.time()
+    waited = False
+    while True:
+        hit = cache_get(source, author_id)
+        if usable_hit(hit, min_year, max_age, requested_at):
+            inc('dashboard_cache_coalesced_total' if waited else 'dashboard_cache_hits_total', source=source)
+            return hit[0]
+        if acquire_fetch(source, author_id):
+            break
+        ### another worker is fetching this entry: wait for it, then re-check
+        waited = True
+        while fetch_in_flight(source, author_id):
+            time.sleep(INFLIGHT_POLL)
+
+    try:
+        ### the entry may have been stored between the check and the lease
+        hit = cache_get(source, author_id)
+        if usable_hit(hit, min_year, max_age, requested_at):
+            inc('dashboard_cache_coalesced_total' if waited else 'dashboard_cache_hits_total', source=source)
+            return hit[0]
+        now = time.time()
+        if full or (hit is None) or (hit[1] > min_year):
+            inc('dashboard_cache_misses_total', source=source)
+            df = fetch_fn(author_id, None, min_year)
+        else:
+            df, min_year, fetched_at = hit
+            inc('dashboard_cache_refreshes_total', source=source)
+            since = datetime.date.fromtimestamp(fetched_at)
+            df = merge_records(df, fetch_fn(author_id, since, min_year))
+        cache_put(source, author_id, df, min_year, fetched_at=now)
+        return df
+    finally:
+        release_fetch(source, author_id)
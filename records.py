@@ -0,0 +1,80 @@
+import sys
+import array
+import numpy as np
+import pandas as pd
+
+from matching import add_match_keys
+
+
+#####################################
+# Work record schemas
+#####################################
+# WOS and OpenAlex works are collected into columnar buffers laid out by a
+# schema: years as int32, journal names and ISSNs interned and categorical.
+# The match keys (normalized DOI and a title + year hash, see matching.py)
+# are computed once when a buffer becomes a DataFrame and are stored with the
+# records, so the matching, aggregate and table stages never normalize the
+# same strings again.
+
+wos_schema = {'work_id': 'str', 'title': 'str', 'source': 'category', 'publishYear': 'year',
+              'doi': 'str', 'issn': 'category', 'eissn': 'category'}
+alex_schema = {'work_id': 'str', 'work_title': 'str', 'work_publication_year': 'year',
+               'work_source': 'category', 'work_doi': 'str'}
+
+### (title, year, doi) columns the match keys are computed from
+match_fields = {'wos': ('title', 'publishYear', 'doi'),
+                'alex': ('work_title', 'work_publication_year', 'work_doi')}
+
+key_columns = ['doi_key', 'title_key']
+category_columns = [name for schema in (wos_schema, alex_schema) for name, kind in schema.items() if kind == 'category']
+
+
+class WorkBuffer:
+    ### One typed column per schema field; append() takes the values in schema
+    ### order. A missing year is stored as 0, which no year filter selects.
+    def __init__(self, source):
+        self.source = source
+        self.schema = wos_schema if source == 'wos' else alex_schema
+        self.columns = {name: array.array('i') if kind == 'year' else [] for name, kind in self.schema.items()}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def append(self, *values):
+        for (name, kind), value in zip(self.schema.items(), values):
+            if kind == 'year':
+                value = int(value) if value is not None else 0
+            elif (kind == 'category') and (value is not None):
+                value = sys.intern(value)
+            self.columns[name].append(value)
+
+    def to_frame(self):
+        data = {}
+        for name, kind in self.schema.items():
+            if kind == 'year':
+                data[name] = np.array(self.columns[name], dtype=np.int32)
+            elif kind == 'category':
+                data[name] = pd.Categorical(self.columns[name])
+            else:
+                data[name] = self.columns[name]
+        return add_match_keys(pd.DataFrame(data), *match_fields[self.source])
+
+
+def concat_records(frames, key='work_id'):
+    ### frames stacked with later copies of a work replacing earlier ones;
+    ### categories that differ between frames are merged instead of falling
+    ### back to object columns
+    df = pd.concat(frames, axis=0, ignore_index=True)
+    df = df.drop_duplicates(subset=[key], keep='last').reset_index(drop=True)
+    for col in category_columns:
+        if (col in df.columns) and (df[col].dtype != 'category'):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def ensure_match_keys(df, source):
+    ### records stored before the keys were kept get them on read; match_key
+    ### is the title key of an older normalization and is recomputed
+    if 'title_key' in df.columns:
+        return df
+    return add_match_keys(df.drop(columns=['match_key'], errors='ignore'), *match_fields[source])
@@ -0,0 +1,108 @@
+import re
+import bisect
+import unicodedata
+
+from data_store import read_store, ROSTER_PATH, ID_LOOKUP_PATH
+
+
+#####################################
+# Employee roster and id lookup
+#####################################
+# Read from the memory-mapped Arrow files written by data_store.py, projected
+# to the columns the dashboard uses.
+
+roster_columns = ['emp_id','first_name','last_name','preferred_name','position','department','college','is_faculty']
+
+CAS = read_store(ROSTER_PATH, roster_columns)
+emp = CAS[CAS['is_faculty']]
+
+id_lookup = read_store(ID_LOOKUP_PATH, ['emp_id','wos_id','alex_id'])
+
+
+def build_emp_index(emp_in, id_lookup_in):
+    ### One dict per employee with the CAS fields and every WOS / OpenAlex id
+    ### from id_lookup, keyed by emp_id; names map to emp_id
+    emp_by_id = {}
+    emp_by_name = {}
+    for row in emp_in[['emp_id','first_name','last_name','preferred_name','position','department','college']].itertuples(index=False):
+        emp_by_id[int(row.emp_id)] = dict(row._asdict(), emp_id=int(row.emp_id), wos_ids=[], alex_ids=[])
+        emp_by_name.setdefault(row.preferred_name, int(row.emp_id))
+    for row in id_lookup_in[['emp_id','wos_id','alex_id']].itertuples(index=False):
+        record = emp_by_id.get(int(row.emp_id))
+        if record is not None:
+            record['wos_ids'].append(row.wos_id)
+            record['alex_ids'].append(row.alex_id)
+    return emp_by_id, emp_by_name
+
+
+emp_by_id, emp_by_name = build_emp_index(emp, id_lookup)
+
+
+def find_lookup_record(author_in):
+    ### author_in: preferred name as shown in the employee dropdown
+    return emp_by_id[emp_by_name[author_in]]
+
+
+
+#####################################
+# Employee typeahead index
+#####################################
+# Every token of an employee's names, department and position maps to the
+# employees carrying it. Tokens are kept sorted, so a typed prefix is a bisect
+# plus a scan over the tokens that start with it, and the browser only ever
+# receives the top matches.
+
+search_fields = ['preferred_name', 'first_name', 'last_name', 'department', 'position']
+
+
+def search_tokens(text):
+    ### lowercase ascii words; accents folded
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def search_text(record):
+    return ' '.join(record[field] for field in search_fields if isinstance(record[field], str))
+
+
+def build_search_index(emp_by_id_in):
+    ### (sorted tokens, token -> set of emp_ids)
+    postings = {}
+    for emp_id, record in emp_by_id_in.items():
+        for token in search_tokens(search_text(record)):
+            postings.setdefault(token, set()).add(emp_id)
+    return sorted(postings), postings
+
+
+sorted_tokens, token_postings = build_search_index(emp_by_id)
+
+
+def prefix_matches(prefix):
+    matches = set()
+    i = bisect.bisect_left(sorted_tokens, prefix)
+    while (i < len(sorted_tokens)) and sorted_tokens[i].startswith(prefix):
+        matches |= token_postings[sorted_tokens[i]]
+        i += 1
+    return matches
+
+
+def search_employees(query, limit=20):
+    ### emp_ids of the employees matching every typed word as a prefix, people
+    ### whose name starts with the query first
+    tokens = search_tokens(query)
+    if len(tokens) == 0:
+        return []
+    matches = None
+    for token in sorted(tokens, key=len, reverse=True):
+        matches = prefix_matches(token) if matches is None else matches & prefix_matches(token)
+        if len(matches) == 0:
+            return []
+    query_text = ' '.join(tokens)
+
+    def rank(emp_id):
+        record = emp_by_id[emp_id]
+        name = ' '.join(search_tokens(record['preferred_name']))
+        last_name = ' '.join(search_tokens(record['last_name'] or ''))
+        return (not name.startswith(query_text), not last_name.startswith(query_text), name)
+
+    return sorted(matches, key=rank)[:limit]
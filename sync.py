@@ -0,0 +1,146 @@
+import os
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from record_cache import CACHE_PATH, get_cached_records, list_entries
+from fetch_engine import source_fetchers, read_emp_records, stored_min_year
+from aggregates import update_person_counts
+from roster import emp_by_id
+from http_client import FetchError, OPENALEX_API_KEY
+from metrics import flush
+
+
+#####################################
+# Scheduled incremental sync
+#####################################
+# Keeps every harvested (source, author id) entry of the publication store
+# fresh without full harvests. The fetch time of an entry is its high-water
+# mark: once it is older than SYNC_MAX_AGE the entry is refreshed with only the
+# works created or modified since the mark (OpenAlex from_updated_date, WOS
+# modifiedTimeSpan with early stop) and the delta is merged into the store.
+# Every SYNC_FULL_AGE an entry is harvested in full once, which picks up edits
+# to older WOS records that the early stop skips. The OpenAlex delta filter
+# needs an API key (OPENALEX_API_KEY); without one, OpenAlex entries are only
+# refreshed by the full harvest. Runs next to the dashboard:
+#
+#     python sync.py              # a pass every SYNC_INTERVAL seconds
+#     python sync.py --once       # a single pass, e.g. from cron
+
+SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL', 60*60))           # seconds between passes
+SYNC_MAX_AGE = int(os.environ.get('SYNC_MAX_AGE', 24*60*60))          # entry age that makes it due
+SYNC_FULL_AGE = int(os.environ.get('SYNC_FULL_AGE', 30*24*60*60))     # seconds between full harvests of an entry
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', 4))
+SYNC_BATCH = int(os.environ.get('SYNC_BATCH', 500))                   # entries per pass, oldest first
+
+
+def _connect():
+    con = sqlite3.connect(CACHE_PATH, timeout=30)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                       source TEXT NOT NULL,
+                       author_id TEXT NOT NULL,
+                       full_at REAL NOT NULL,
+                       synced_at REAL NOT NULL,
+                       PRIMARY KEY (source, author_id))''')
+    return con
+
+
+def load_full_marks():
+    con = _connect()
+    try:
+        rows = con.execute('SELECT source, author_id, full_at FROM sync_state').fetchall()
+    finally:
+        con.close()
+    return {(source, author_id): full_at for source, author_id, full_at in rows}
+
+
+def save_marks(source, author_id, full_at, synced_at):
+    con = _connect()
+    try:
+        with con:
+            con.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)', (source, author_id, full_at, synced_at))
+    finally:
+        con.close()
+
+
+def due_entries(now):
+    ### (source, author_id, min_year, full, full_at) of the entries past
+    ### SYNC_MAX_AGE, oldest mark first; entries start with a full harvest, so
+    ### one never synced counts its fetch time as its last full harvest
+    full_marks = load_full_marks()
+    due = []
+    for source, author_id, min_year, fetched_at in list_entries():
+        if now - fetched_at < SYNC_MAX_AGE:
+            continue
+        full_at = full_marks.get((source, author_id), fetched_at)
+        full = now - full_at >= SYNC_FULL_AGE
+        if (source == 'alex') and (not OPENALEX_API_KEY) and (not full):
+            continue
+        due.append((fetched_at, source, author_id, min_year, full, full_at))
+    due.sort()
+    return [entry[1:] for entry in due[:SYNC_BATCH]]
+
+
+def sync_entry(source, author_id, min_year, full, full_at):
+    started = time.time()
+    get_cached_records(source, author_id, source_fetchers[source], min_year, max_age=SYNC_MAX_AGE, full=full)
+    save_marks(source, author_id, started if full else full_at, time.time())
+
+
+def author_employees():
+    ### (source, author id) -> emp_id, to refresh the count matrix after a pass
+    owners = {}
+    for emp_id, record in emp_by_id.items():
+        for wos_id in record['wos_ids']:
+            owners[('wos', wos_id)] = emp_id
+        for alex_id in record['alex_ids']:
+            owners[('alex', alex_id)] = emp_id
+    return owners
+
+
+def sync_pass(workers=SYNC_WORKERS):
+    t0 = time.time()
+    due = due_entries(t0)
+    owners = author_employees()
+    synced = set()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(sync_entry, *entry): entry for entry in due}
+        for future in as_completed(futures):
+            source, author_id = futures[future][:2]
+            try:
+                future.result()
+            except FetchError as e:
+                failed += 1
+                print(f'{source} {author_id}: sync failed: {e}')
+                continue
+            emp_id = owners.get((source, author_id))
+            if emp_id is not None:
+                synced.add(emp_id)
+
+    ### the department / college counts follow the merged records
+    for emp_id in synced:
+        min_year = stored_min_year(emp_by_id[emp_id])
+        if min_year is None:
+            continue
+        df_wos, df_alex = read_emp_records(emp_by_id[emp_id])
+        update_person_counts(emp_id, df_wos, df_alex, min_year)
+    n_full = sum(1 for entry in due if entry[3])
+    print(f'synced {len(due)-failed} entries ({n_full} full), {failed} failed, in {time.time()-t0:.0f}s')
+    flush()
+    return len(due), failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the publication store fresh with incremental syncs.')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS, help='entries synced in parallel')
+    args = parser.parse_args()
+    while True:
+        started = time.time()
+        sync_pass(args.workers)
+        if args.once:
+            break
+        time.sleep(max(0, SYNC_INTERVAL - (time.time() - started)))